@@ -5,7 +5,8 @@ import matplotlib.pyplot as plt
 
 # Load the Excel file
 file_path = "all_results_NAF.xlsx"  # Replace with your actual file path
-df = pd.read_excel(file_path)
+sheets = pd.read_excel(file_path, sheet_name=None)
+df = sheets.get("Summary", next(iter(sheets.values())))  # files from before the Sentences/Summary split have one sheet
 
 df = df.sort_values(by="Mean_Match", ascending=True)
 
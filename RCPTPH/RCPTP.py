@@ -3,15 +3,9 @@
 import pandas as pd
 import numpy as np
 
-def calculate_matching_percentage(ref_pos, pred_pos):
-    """
-    Calculate the percentage of matching POS tags between reference and prediction.
-    """
-    total_tags = len(ref_pos)
-    correct_tags = sum([1 for ref, pred in zip(ref_pos, pred_pos) if ref == pred])
-    return (correct_tags / total_tags) * 100 if total_tags > 0 else 0
+from segment_metrics import encode_tags, sentence_offsets, sentence_scores
 
-def find_first_matching_sentence(reference_file, prediction_file, sentences_file):
+def find_first_matching_sentence(reference_file, prediction_file, sentences_file, show_words=True):
     """
     Find and display the percentage of matching POS tags for each sentence.
     """
@@ -19,50 +13,38 @@ def find_first_matching_sentence(reference_file, prediction_file, sentences_file
     ref_df = pd.read_excel(reference_file)
     pred_df = pd.read_excel(prediction_file)
     
-    with open(sentences_file, 'r', encoding='utf-8') as f:
-        sentences = [s.strip() for s in f.readlines()]
+    # Score all sentences at once
+    starts, lengths = sentence_offsets(sentences_file)
+    ref_codes, pred_codes = encode_tags(ref_df['POS'], pred_df['upos'])
+    match_percentages, _, _ = sentence_scores(ref_codes, pred_codes, starts, lengths)
     
-    current_idx = 0
-    results = []
     print("\nCalculating POS tag match percentages for each sentence...\n")
     
-    for sentence_idx, sentence in enumerate(sentences):
-        words = sentence.split()
-        sentence_length = len(words)
-        
-        # Get current sentence slice from both dataframes
-        ref_slice = ref_df.iloc[current_idx:current_idx + sentence_length]
-        pred_slice = pred_df.iloc[current_idx:current_idx + sentence_length]
-        
-        # Get POS tags
-        ref_pos = ref_slice['POS'].tolist()
-        pred_pos = pred_slice['upos'].tolist()
-        
-        # Calculate the matching percentage
-        match_percentage = calculate_matching_percentage(ref_pos, pred_pos)
-        
+    words = ref_df['Lemma'].to_numpy()
+    ref_pos = ref_df['POS'].to_numpy()
+    pred_pos = pred_df['upos'].to_numpy()
+    for sentence_idx, (start, length, match_percentage) in enumerate(zip(starts, lengths, match_percentages)):
         print(f"Sentence {sentence_idx + 1}: {match_percentage:.2f}% of POS tags match")
         
         # Optional: Show a breakdown if you want to compare each word's POS tag
-        comparison = pd.DataFrame({
-            'Word': ref_slice['Lemma'],
-            'Reference_POS': ref_slice['POS'],
-            'Predicted_POS': pred_slice['upos'],
-            'Match': [ref == pred for ref, pred in zip(ref_pos, pred_pos)]
-        })
-        
-        print("\nWord-by-word comparison:")
-        print(comparison.to_string(index=False))
-        print("-" * 80)
-        sentence_result = {
-            'Sentence_ID': sentence_idx + 1,
-            'Match_Percentage': match_percentage
-        }
-        results.append(sentence_result)
-        
-        current_idx += sentence_length
+        if show_words:
+            end = start + length
+            n = min(len(ref_pos[start:end]), len(pred_pos[start:end]))
+            comparison = pd.DataFrame({
+                'Word': words[start:end][:n],
+                'Reference_POS': ref_pos[start:end][:n],
+                'Predicted_POS': pred_pos[start:end][:n],
+                'Match': ref_pos[start:end][:n] == pred_pos[start:end][:n]
+            })
+            
+            print("\nWord-by-word comparison:")
+            print(comparison.to_string(index=False))
+            print("-" * 80)
     
-    results_df = pd.DataFrame(results)
+    results_df = pd.DataFrame({
+        'Sentence_ID': np.arange(1, len(starts) + 1),
+        'Match_Percentage': match_percentages
+    })
     
     # Calculate mean and standard deviation
     mean_match = np.mean(results_df['Match_Percentage'])
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Sentence-level scores of POS predictions without a loop over sentences.
+
+Sentence offsets come from the corpus index of the sentences file (one
+sentence per line, read like readlines(), so an empty line is an empty
+sentence), which is built once per text. The reference and every prediction
+are joined by position, and the matches are summed per sentence from one
+cumulative sum. All prediction files are scored against the same offsets and
+reference in one run.
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from corpus_index import load_index
+
+
+def sentence_offsets(sentences_file):
+    """Start position and number of words of every line of the sentences file."""
+    index = load_index(sentences_file)
+    return index.sentence_starts, index.sentence_lengths
+
+
+def encode_tags(reference_tags, prediction_tags):
+    """Integer codes for a positional comparison; missing and unknown tags never match."""
+    reference_codes, labels = pd.factorize(pd.Series(reference_tags))
+    prediction_codes = pd.Index(labels).get_indexer(pd.Series(prediction_tags))
+    prediction_codes[prediction_codes < 0] = -2
+    return reference_codes, prediction_codes
+
+
+def sentence_scores(reference_codes, prediction_codes, starts, lengths):
+    """
+    Per sentence: match percentage and whether every word is correct.
+
+    Like slicing both tables with iloc per sentence: positions beyond the end
+    of the reference are not counted, positions beyond the end of the
+    prediction count as errors, and a sentence without words scores 0.
+    """
+    n_reference = len(reference_codes)
+    n_joined = min(n_reference, len(prediction_codes))
+    correct = np.zeros(n_reference, dtype=np.int64)
+    correct[:n_joined] = reference_codes[:n_joined] == prediction_codes[:n_joined]
+    cumulative = np.concatenate(([0], np.cumsum(correct)))
+
+    begin = np.minimum(starts, n_reference)
+    end = np.minimum(starts + lengths, n_reference)
+    correct_tags = cumulative[end] - cumulative[begin]
+    total_tags = end - begin
+    match_percentage = np.divide(correct_tags * 100, total_tags, out=np.zeros(len(starts)), where=total_tags > 0)
+    fully_correct = (total_tags > 0) & (correct_tags == total_tags)
+    return match_percentage, fully_correct, total_tags
+
+
+def evaluate_predictions(reference_file, prediction_files, sentences_file,
+                         reference_column='POS', prediction_column='upos'):
+    """
+    Score every prediction file per sentence. Returns (sentences, summary):
+    one row per file and sentence (Prediction_File, Sentence_ID,
+    Match_Percentage) and one row per file (Prediction_File, Mean_Match,
+    Std_Dev, Fully_Correct_Ratio).
+    """
+    reference_tags = pd.read_excel(reference_file)[reference_column]
+    starts, lengths = sentence_offsets(sentences_file)
+    sentence_ids = np.arange(1, len(starts) + 1)
+
+    all_sentences = []
+    summary = []
+    for prediction_file in prediction_files:
+        prediction_tags = pd.read_excel(prediction_file)[prediction_column]
+        reference_codes, prediction_codes = encode_tags(reference_tags, prediction_tags)
+        match_percentage, fully_correct, total_tags = sentence_scores(reference_codes, prediction_codes, starts, lengths)
+
+        name = os.path.basename(prediction_file)
+        all_sentences.append(pd.DataFrame({
+            'Prediction_File': name,
+            'Sentence_ID': sentence_ids,
+            'Match_Percentage': match_percentage
+        }))
+        summary.append({
+            'Prediction_File': name,
+            'Mean_Match': np.mean(match_percentage),
+            'Std_Dev': np.std(match_percentage),
+            'Fully_Correct_Ratio': fully_correct[total_tags > 0].mean() if (total_tags > 0).any() else 0.0
+        })
+    sentences = pd.concat(all_sentences, ignore_index=True) if all_sentences else pd.DataFrame(
+        columns=['Prediction_File', 'Sentence_ID', 'Match_Percentage'])
+    return sentences, pd.DataFrame(summary)
+
+
+def save_results(sentences, summary, output_file):
+    """Per-sentence results on the "Sentences" sheet, mean and standard deviation on the "Summary" sheet."""
+    with pd.ExcelWriter(output_file) as writer:
+        sentences.to_excel(writer, sheet_name="Sentences", index=False)
+        summary.to_excel(writer, sheet_name="Summary", index=False)
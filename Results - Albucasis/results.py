@@ -1,13 +1,132 @@
 # -*- coding: utf-8 -*-
 
-from sklearn.metrics import precision_recall_fscore_support, accuracy_score, confusion_matrix, balanced_accuracy_score
+import numpy as np
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 import os
 
-def calculate_and_display_metrics(y_true, y_pred, unique_pos_values_list):
+def _divide(numerator, denominator):
+    # sklearn's zero_division=0: scores with a zero denominator are 0
+    denominator = np.asarray(denominator, dtype=float)
+    result = np.asarray(numerator, dtype=float) / np.where(denominator == 0, 1.0, denominator)
+    result[denominator == 0] = 0.0
+    return result
+
+def confusion_matrix_metrics(y_true, y_pred, labels):
+    """
+    Compute every metric of calculate_and_display_metrics from one confusion matrix.
+
+    Tags are encoded to integer codes once (labels first, then every other tag
+    seen) and all (true, predicted) pairs are counted with a single bincount.
+    The scores follow sklearn with zero_division=0: precision, recall, F1,
+    accuracy and balanced accuracy only count tokens whose predicted tag is in
+    labels, the confusion matrix only pairs where both tags are, and the error
+    counts use all tokens.
+    """
+    y_true = np.asarray(y_true, dtype=object)
+    y_pred = np.asarray(y_pred, dtype=object)
+    labels = list(labels)
+    n_labels = len(labels)
+    label_set = set(labels)
+    tags = labels + [tag for tag in pd.unique(np.concatenate([y_true, y_pred])) if tag not in label_set]
+    n_tags = len(tags)
+    index = pd.Index(tags, dtype=object)
+    codes = index.get_indexer(y_true) * n_tags + index.get_indexer(y_pred)
+    counts = np.bincount(codes, minlength=n_tags * n_tags).reshape(n_tags, n_tags)
+
+    # tokens with a predicted tag outside labels are excluded from the scores
+    scored = counts[:, :n_labels]
+    tp = np.diagonal(scored).copy()
+    pred_sum = scored.sum(axis=0)
+    true_sum = scored[:n_labels].sum(axis=1)
+    n_scored = scored.sum()
+
+    precision = _divide(tp, pred_sum)
+    recall = _divide(tp, true_sum)
+    f1 = _divide(2.0 * tp, true_sum.astype(float) + pred_sum.astype(float))
+
+    def weighted(values):
+        return float(np.average(values, weights=true_sum)) if true_sum.sum() else float(np.average(values))
+
+    micro_precision = float(_divide([tp.sum()], [pred_sum.sum()])[0])
+    micro_recall = float(_divide([tp.sum()], [true_sum.sum()])[0])
+    micro_f1 = float(_divide([2.0 * tp.sum()], [float(true_sum.sum()) + float(pred_sum.sum())])[0])
+
+    # balanced accuracy: mean recall over the true tags of the scored tokens, in sorted tag order like sklearn
+    tag_support = scored.sum(axis=1)
+    tag_correct = np.zeros(n_tags, dtype=np.int64)
+    tag_correct[:n_labels] = tp
+    present = sorted((k for k in range(n_tags) if tag_support[k]), key=tags.__getitem__)
+    balanced_accuracy = float(np.mean(tag_correct[present] / tag_support[present]))
+
+    # misclassifications of all tokens, ordered like a groupby(['True', 'Predicted']).size()
+    true_codes, pred_codes = np.nonzero(counts)
+    off_diagonal = true_codes != pred_codes
+    true_codes, pred_codes = true_codes[off_diagonal], pred_codes[off_diagonal]
+    tag_array = np.asarray(tags, dtype=object)
+    error_counts = pd.DataFrame({
+        'True': tag_array[true_codes],
+        'Predicted': tag_array[pred_codes],
+        'count': counts[true_codes, pred_codes]
+    })
+    error_counts = error_counts.sort_values(['True', 'Predicted']).reset_index(drop=True)
+    error_counts = error_counts.sort_values('count', ascending=False)
+
+    return {
+        'labels': labels,
+        'confusion_matrix': counts[:n_labels, :n_labels],
+        'precision': precision,
+        'recall': recall,
+        'f1': f1,
+        'support': true_sum,
+        'micro_avg': (micro_precision, micro_recall, micro_f1),
+        'macro_avg': (float(np.nanmean(precision)), float(np.nanmean(recall)), float(np.nanmean(f1))),
+        'weighted_avg': (weighted(precision), weighted(recall), weighted(f1)),
+        'accuracy': float(np.trace(scored[:n_labels]) / n_scored),
+        'balanced_accuracy': balanced_accuracy,
+        'error_counts': error_counts,
+        'unknown_tags': {tags[k] for k in range(n_labels, n_tags) if counts[:, k].any()},
+        'excluded_tokens': int(len(y_pred) - n_scored),
+    }
+
+def plot_confusion_matrices(cm_df, cm_percentages, labels_for_matrix):
+    """Show the count and percentage confusion matrices as interactive figures."""
+    plt.figure(figsize=(12, 8))
+    sns.heatmap(cm_df, 
+                annot=True, 
+                fmt='d',
+                cmap='Blues',
+                xticklabels=labels_for_matrix,
+                yticklabels=labels_for_matrix)
+    
+    plt.title('Confusion Matrix - NAF6195')
+    plt.xlabel('Predicted')
+    plt.ylabel('True')
+    plt.xticks(rotation=45, ha='right')
+    plt.yticks(rotation=0)
+    plt.tight_layout()
+    
+    # Create percentage-based confusion matrix
+    plt.figure(figsize=(12, 8))
+    sns.heatmap(cm_percentages, 
+                annot=True, 
+                fmt='.1f',
+                cmap='RdYlBu_r',
+                xticklabels=labels_for_matrix,
+                yticklabels=labels_for_matrix)
+    
+    plt.title('Confusion Matrix (Percentages) - NAF6195')
+    plt.xlabel('Predicted')
+    plt.ylabel('True')
+    plt.xticks(rotation=45, ha='right')
+    plt.yticks(rotation=0)
+    plt.tight_layout()
+
+def calculate_and_display_metrics(y_true, y_pred, unique_pos_values_list, plot=True):
     """
     Calculate and display classification metrics with enhanced confusion matrix visualization
     and multiple strategies for handling unknown tags.
@@ -23,64 +142,21 @@ def calculate_and_display_metrics(y_true, y_pred, unique_pos_values_list):
     handle_unknown :
         Strategy for handling unknown tags:
         - 'ignore': exclude tokens with predicted tags not in reference
+    plot : bool
+        Show the confusion matrices as figures; False computes the metrics only
     """
-    # Convert inputs to lists for easier processing
-    y_true = list(y_true)
-    y_pred = list(y_pred)
-    
-    # Find unknown tags
-    reference_tags = set(unique_pos_values_list)
-    pred_tags = set(y_pred)
-    unknown_tags = pred_tags - reference_tags
-    
-    # Initialize labels for confusion matrix
+    metrics = confusion_matrix_metrics(y_true, y_pred, unique_pos_values_list)
     labels_for_matrix = unique_pos_values_list.copy()
-    # Keep only predictions where the tag exists in reference
-    valid_indices = [i for i, tag in enumerate(y_pred) if tag in reference_tags]
-    y_true1 = [y_true[i] for i in valid_indices]
-    y_pred1 = [y_pred[i] for i in valid_indices]
+    unknown_tags = metrics['unknown_tags']
     print(f"\nWarning: Ignored {len(unknown_tags)} unknown tags: {unknown_tags}")
-    print(f"Excluded {len(y_pred) - len(valid_indices)} tokens from evaluation")
-    
-    precision, recall, f1, support = precision_recall_fscore_support(
-        y_true1, 
-        y_pred1, 
-        labels=unique_pos_values_list,
-        average=None,
-        zero_division=0
-    )
-
-    # Calculate weighted averages
-    weighted_precision, weighted_recall, weighted_f1, _ = precision_recall_fscore_support(
-        y_true1, 
-        y_pred1, 
-        labels=labels_for_matrix,
-        average='weighted',
-        zero_division=0
-    )
-    
-    # Calculate macro averages
-    macro_precision, macro_recall, macro_f1, _ = precision_recall_fscore_support(
-        y_true1, 
-        y_pred1, 
-        labels=labels_for_matrix,
-        average='macro',
-        zero_division=0
-    )
-    
-    # Calculate micro averages
-    micro_precision, micro_recall, micro_f1, _ = precision_recall_fscore_support(
-        y_true1, 
-        y_pred1, 
-        labels=labels_for_matrix,
-        average='micro',
-        zero_division=0
-    )
-    
-    # Calculate overall accuracy
-    accuracy = accuracy_score(y_true1, y_pred1)
+    print(f"Excluded {metrics['excluded_tokens']} tokens from evaluation")
     
-    balanced_accuracy = balanced_accuracy_score(y_true1, y_pred1)
+    precision, recall, f1, support = metrics['precision'], metrics['recall'], metrics['f1'], metrics['support']
+    weighted_precision, weighted_recall, weighted_f1 = metrics['weighted_avg']
+    macro_precision, macro_recall, macro_f1 = metrics['macro_avg']
+    micro_precision, micro_recall, micro_f1 = metrics['micro_avg']
+    accuracy = metrics['accuracy']
+    balanced_accuracy = metrics['balanced_accuracy']
     
     # Create detailed per-class DataFrame
     detailed_metrics = pd.DataFrame({
@@ -108,46 +184,16 @@ def calculate_and_display_metrics(y_true, y_pred, unique_pos_values_list):
     
     detailed_metrics['Support'] = detailed_metrics['Support'].astype(int)
     
-    # Create and plot confusion matrix
-    plt.figure(figsize=(12, 8))
-    cm = confusion_matrix(y_true, y_pred, labels=labels_for_matrix)
-    cm_df = pd.DataFrame(cm, 
+    # Create confusion matrix
+    cm_df = pd.DataFrame(metrics['confusion_matrix'], 
                         index=labels_for_matrix,
                         columns=labels_for_matrix)
     
     # Calculate percentages for annotations
     cm_percentages = cm_df.div(cm_df.sum(axis=1), axis=0) * 100
     
-    # Create heatmap
-    sns.heatmap(cm_df, 
-                annot=True, 
-                fmt='d',
-                cmap='Blues',
-                xticklabels=labels_for_matrix,
-                yticklabels=labels_for_matrix)
-    
-    plt.title('Confusion Matrix - NAF6195')
-    plt.xlabel('Predicted')
-    plt.ylabel('True')
-    plt.xticks(rotation=45, ha='right')
-    plt.yticks(rotation=0)
-    plt.tight_layout()
-    
-    # Create percentage-based confusion matrix
-    plt.figure(figsize=(12, 8))
-    sns.heatmap(cm_percentages, 
-                annot=True, 
-                fmt='.1f',
-                cmap='RdYlBu_r',
-                xticklabels=labels_for_matrix,
-                yticklabels=labels_for_matrix)
-    
-    plt.title('Confusion Matrix (Percentages) - NAF6195')
-    plt.xlabel('Predicted')
-    plt.ylabel('True')
-    plt.xticks(rotation=45, ha='right')
-    plt.yticks(rotation=0)
-    plt.tight_layout()
+    if plot:
+        plot_confusion_matrices(cm_df, cm_percentages, labels_for_matrix)
     
     # Display metrics
     print("\n=== CLASSIFICATION METRICS SUMMARY ===")
@@ -174,13 +220,7 @@ def calculate_and_display_metrics(y_true, y_pred, unique_pos_values_list):
     print("\n" + detailed_metrics.to_string(index=False))
     
     # Calculate and display error analysis
-    errors = pd.DataFrame({
-        'True': y_true,
-        'Predicted': y_pred
-    })
-    errors = errors[errors['True'] != errors['Predicted']]
-    error_counts = errors.groupby(['True', 'Predicted']).size().reset_index(name='count')
-    error_counts = error_counts.sort_values('count', ascending=False)
+    error_counts = metrics['error_counts']
     
     print("\n=== TOP CLASSIFICATION ERRORS ===")
     print("\nMost common misclassifications (True -> Predicted):")
@@ -198,37 +238,59 @@ def calculate_and_display_metrics(y_true, y_pred, unique_pos_values_list):
         'unknown_tags': list(unknown_tags) if unknown_tags else []
     }
 
-def save_results(results, base_filename):
-    """Save confusion matrices, metrics, and errors to the specified folder."""
+def figure_jobs(results, base_filename):
+    """
+    Describe the heatmaps of save_results as plain data (matrix, style, output
+    path), so they can be drawn later and in other processes.
+    """
+    base_name = os.path.splitext(os.path.basename(base_filename))[0]
+    folder_name = base_name
+    return [
+        {'data': results['confusion_matrix'], 'fmt': 'd', 'cmap': 'Blues',
+         'title': 'Confusion Matrix', 'xlabel': 'Predicted', 'ylabel': 'True', 'rotate_ticks': True,
+         'path': os.path.join(folder_name, f'{base_name}_confusion_matrix.png')},
+        {'data': results['confusion_matrix_percentages'], 'fmt': '.1f', 'cmap': 'RdYlBu_r',
+         'title': 'Confusion Matrix (Percentages)', 'xlabel': 'Predicted', 'ylabel': 'True', 'rotate_ticks': True,
+         'path': os.path.join(folder_name, f'{base_name}_confusion_matrix_percentages.png')},
+        {'data': results['detailed_metrics'].set_index('POS Tag').drop(columns='Support').astype(float).transpose(),
+         'fmt': '.4f', 'cmap': 'viridis',
+         'title': 'Classification Metrics', 'xlabel': 'POS Tag', 'ylabel': 'Metric', 'rotate_ticks': False,
+         'path': os.path.join(folder_name, f'{base_name}_classification_metrics.png')},
+    ]
+
+def render_figure(job):
+    """Draw one heatmap on an Agg canvas (no pyplot state, nothing left open) and save it."""
+    fig = Figure(figsize=(12, 8))
+    ax = fig.subplots()
+    sns.heatmap(job['data'], annot=True, fmt=job['fmt'], cmap=job['cmap'], ax=ax)
+    ax.set_title(job['title'])
+    ax.set_xlabel(job['xlabel'])
+    ax.set_ylabel(job['ylabel'])
+    if job['rotate_ticks']:
+        ax.set_xticklabels(ax.get_xticklabels(), rotation=45, ha='right')
+        ax.set_yticklabels(ax.get_yticklabels(), rotation=0)
+    fig.tight_layout()
+    fig.savefig(job['path'])
+    return job['path']
+
+def render_figures(jobs, num_workers=None):
+    """Draw all heatmap jobs in a process pool (num_workers=1 draws them in this process)."""
+    if num_workers == 1:
+        return [render_figure(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        return list(executor.map(render_figure, jobs))
+
+def save_results(results, base_filename, render=True):
+    """
+    Save confusion matrices, metrics, and errors to the specified folder.
+    With render=False only the tables are written; the heatmaps can then be
+    drawn with render_figures(figure_jobs(results, base_filename)).
+    """
     # Get base name without extension
     base_name = os.path.splitext(os.path.basename(base_filename))[0]
     folder_name = base_name
     os.makedirs(folder_name, exist_ok=True)
     
-    # Save confusion matrix image
-    fig_cm, ax_cm = plt.subplots(figsize=(12, 8))
-    sns.heatmap(results['confusion_matrix'], annot=True, fmt='d', cmap='Blues', ax=ax_cm)
-    plt.title('Confusion Matrix')
-    plt.xlabel('Predicted')
-    plt.ylabel('True')
-    plt.xticks(rotation=45, ha='right')
-    plt.yticks(rotation=0)
-    plt.tight_layout()
-    fig_cm.savefig(os.path.join(folder_name, f'{base_name}_confusion_matrix.png'))
-    plt.close(fig_cm)
-    
-    # Save percentage-based confusion matrix image
-    fig_cm_pct, ax_cm_pct = plt.subplots(figsize=(12, 8))
-    sns.heatmap(results['confusion_matrix_percentages'], annot=True, fmt='.1f', cmap='RdYlBu_r', ax=ax_cm_pct)
-    plt.title('Confusion Matrix (Percentages)')
-    plt.xlabel('Predicted')
-    plt.ylabel('True')
-    plt.xticks(rotation=45, ha='right')
-    plt.yticks(rotation=0)
-    plt.tight_layout()
-    fig_cm_pct.savefig(os.path.join(folder_name, f'{base_name}_confusion_matrix_percentages.png'))
-    plt.close(fig_cm_pct)
-    
     # Save confusion matrices to separate Excel files
     results['confusion_matrix'].to_excel(os.path.join(folder_name, f'{base_name}_confusion_matrix_counts.xlsx'))
     results['confusion_matrix_percentages'].to_excel(os.path.join(folder_name, f'{base_name}_confusion_matrix_percentages.xlsx'))
@@ -241,36 +303,40 @@ def save_results(results, base_filename):
     if results['unknown_tags']:
         with open(os.path.join(folder_name, f'{base_name}_unknown_tags.txt'), 'w') as f:
             f.write("\n".join(results['unknown_tags']))
-    
-    # Save classification metrics as a PNG plot
-    fig_metrics, ax_metrics = plt.subplots(figsize=(12, 8))
-    sns.heatmap(results['detailed_metrics'].set_index('POS Tag').drop(columns='Support').astype(float).transpose(), annot=True, fmt='.4f', cmap='viridis',  ax=ax_metrics)
-    plt.title('Classification Metrics')
-    plt.xlabel('POS Tag')
-    plt.ylabel('Metric')
-    plt.tight_layout()
-    fig_metrics.savefig(os.path.join(folder_name, f'{base_name}_classification_metrics.png'))
-    plt.close(fig_metrics)
 
     # Save classification metrics to Excel
     results['detailed_metrics'].to_excel(os.path.join(folder_name, f'{base_name}_classification_metrics.xlsx'), index=False)
 
+    # Save confusion matrix and classification metrics images
+    if render:
+        render_figures(figure_jobs(results, base_filename), num_workers=1)
+
     print(f"Results saved in folder: {folder_name}")
 
 if __name__ == "__main__":
-    file = "Albuc1_tagged_phi4_zero_shot.xlsx" #prediction file
+    files = ["Albuc1_tagged_phi4_zero_shot.xlsx"] #prediction files
     df_gold = pd.read_excel("../data/REF_Albuc_1.xlsx") #reference file
-    df_pred = pd.read_excel(file)
-    
-    # Prepare the data
-    combined_df = pd.concat([df_gold, df_pred], axis=1)
-    combined_df = combined_df[combined_df["upos"] != "missing"]
-    unique_pos_values_list = combined_df['POS'].unique().tolist()
-    y_true = combined_df['POS']
-    y_pred = combined_df['upos']
-    
-    # Calculate and display metrics
-    results = calculate_and_display_metrics(y_true, y_pred, unique_pos_values_list)
-    
-    # Save results
-    save_results(results, file)
\ No newline at end of file
+    metrics_only = False  # True: only the metric tables, no figures
+    
+    jobs = []
+    for file in files:
+        df_pred = pd.read_excel(file)
+        
+        # Prepare the data
+        combined_df = pd.concat([df_gold, df_pred], axis=1)
+        combined_df = combined_df[combined_df["upos"] != "missing"]
+        unique_pos_values_list = combined_df['POS'].unique().tolist()
+        y_true = combined_df['POS']
+        y_pred = combined_df['upos']
+        
+        # Calculate and display metrics
+        results = calculate_and_display_metrics(y_true, y_pred, unique_pos_values_list, plot=False)
+        
+        # Save results, the figures of all files are drawn together below
+        save_results(results, file, render=False)
+        if not metrics_only:
+            jobs.extend(figure_jobs(results, file))
+    
+    if jobs:
+        render_figures(jobs)
+        print(f"Saved {len(jobs)} figures")
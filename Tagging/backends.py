@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import httpx
+import ollama
+
+
+class Endpoint:
+    def __init__(self, host, timeout=None):
+        self.host = host
+        self.client = ollama.Client(host=host, timeout=timeout)
+        self.outstanding = 0
+        self.healthy = True
+        self.last_check = 0.0
+        self.requests = 0
+        self.failures = 0
+
+
+class BackendPool:
+    """
+    Spread generate requests over several Ollama servers.
+
+    Every request goes to the healthy endpoint with the fewest requests in
+    flight. An endpoint that cannot be reached (connection error or
+    timeout) is marked unhealthy and the request is retried on the next
+    one; a streamed request fails over the same way as long as no part of
+    it has arrived. Errors the server answers with, 5xx included, concern
+    the request and are raised to the caller's retry loop. Unhealthy endpoints are checked again (GET /api/tags) once
+    health_interval seconds have passed. When no endpoint is healthy, a
+    request waits for these checks for up to max_wait seconds before it
+    fails. The pool has the same generate() call as the ollama module, so it
+    can replace it in OccPoSTagger.
+    """
+
+    def __init__(self, hosts, health_interval=30, timeout=None, max_wait=300):
+        if not hosts:
+            raise ValueError("BackendPool needs at least one host")
+        self.endpoints = [Endpoint(host, timeout=timeout) for host in hosts]
+        self.health_interval = health_interval
+        self.max_wait = max_wait  # seconds a request waits for an endpoint to recover
+        self._lock = threading.Lock()
+
+    def check_health(self, endpoint):
+        try:
+            endpoint.client.list()
+            healthy = True
+        except Exception:
+            healthy = False
+        with self._lock:
+            endpoint.healthy = healthy
+            endpoint.last_check = time.time()
+        return healthy
+
+    def _acquire(self, exclude):
+        now = time.time()
+        for endpoint in self.endpoints:
+            if not endpoint.healthy and endpoint not in exclude and now - endpoint.last_check >= self.health_interval:
+                self.check_health(endpoint)
+
+        with self._lock:
+            candidates = [e for e in self.endpoints if e.healthy and e not in exclude]
+            if not candidates:
+                return None
+            endpoint = min(candidates, key=lambda e: (e.outstanding, e.requests))
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def _release(self, endpoint, failed=False):
+        with self._lock:
+            endpoint.outstanding -= 1
+            if failed:
+                endpoint.failures += 1
+                endpoint.healthy = False
+                endpoint.last_check = time.time()
+
+    @staticmethod
+    def _is_endpoint_failure(error):
+        # httpx.TransportError covers timeouts and dropped connections
+        return isinstance(error, (ConnectionError, httpx.TransportError))
+
+    def _next_endpoint(self, tried, deadline):
+        """
+        Healthy endpoint that is not in tried. When there is none, wait for
+        the next health check and try all endpoints again, until deadline.
+        """
+        while True:
+            endpoint = self._acquire(tried)
+            if endpoint is not None:
+                tried.append(endpoint)
+                return endpoint
+            now = time.time()
+            if now >= deadline:
+                hosts = ", ".join(e.host for e in self.endpoints)
+                raise ConnectionError(f"No healthy Ollama endpoint left (tried {hosts} for {self.max_wait} seconds)")
+            with self._lock:
+                next_check = min(e.last_check for e in self.endpoints) + self.health_interval
+            time.sleep(max(0.0, min(next_check, deadline) - now))
+            tried.clear()
+
+    def _failover(self, endpoint, error, can_retry=True):
+        """Release a failed request; True if it should be retried on another endpoint."""
+        failed = self._is_endpoint_failure(error)
+        self._release(endpoint, failed=failed)
+        if failed and can_retry:
+            print(f"Endpoint {endpoint.host} failed ({str(error)}), trying next endpoint")
+        return failed and can_retry
+
+    def generate(self, **kwargs):
+        if kwargs.get('stream'):
+            return self._stream(kwargs)
+        deadline = time.time() + self.max_wait
+        tried = []
+        while True:
+            endpoint = self._next_endpoint(tried, deadline)
+            try:
+                response = endpoint.client.generate(**kwargs)
+            except Exception as e:
+                if self._failover(endpoint, e):
+                    continue
+                raise
+            self._release(endpoint)
+            return response
+
+    def _stream(self, kwargs):
+        # the request stays outstanding until the stream is exhausted or closed;
+        # the connection is only made when the first part is read
+        deadline = time.time() + self.max_wait
+        tried = []
+        while True:
+            endpoint = self._next_endpoint(tried, deadline)
+            received = False
+            try:
+                for part in endpoint.client.generate(**kwargs):
+                    received = True
+                    yield part
+            except Exception as e:
+                if self._failover(endpoint, e, can_retry=not received):
+                    continue
+                raise
+            except BaseException:
+                self._release(endpoint)
+                raise
+            self._release(endpoint)
+            return
+
+    def unload_model(self, model_name):
+        for endpoint in self.endpoints:
+            try:
+                endpoint.client.generate(model=model_name, keep_alive=0)
+            except Exception as e:
+                print(f"Could not unload model '{model_name}' on {endpoint.host}: {str(e)}")
+
+    def stats(self):
+        return [{'host': e.host, 'healthy': e.healthy, 'requests': e.requests, 'failures': e.failures}
+                for e in self.endpoints]
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import threading
+
+
+class ChunkCheckpoint:
+    """
+    Append-only JSONL checkpoint of validated chunk results.
+
+    Every line holds the run configuration hash, the chunk number, the chunk
+    text and the tags of its words. Lines written by a run with a different
+    configuration (model, prompt, context size, input text, chunking) are
+    ignored, so a stale checkpoint file never leaks into a new run.
+    """
+
+    def __init__(self, checkpoint_file, run_config):
+        self.checkpoint_file = checkpoint_file
+        self.config_hash = hashlib.sha256(
+            json.dumps(run_config, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+        self._lock = threading.Lock()
+        self.completed = self._load()
+        self._file = open(checkpoint_file, 'a', encoding='utf-8')
+
+    def _load(self):
+        completed = {}
+        if not os.path.exists(self.checkpoint_file):
+            return completed
+        with open(self.checkpoint_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # last line may be cut short by a crash
+                    continue
+                if entry.get('config') == self.config_hash:
+                    completed[entry['chunk']] = entry
+        return completed
+
+    def get(self, chunk_num, chunk):
+        entry = self.completed.get(chunk_num)
+        # lines of older versions hold word/upos dicts under 'result' instead of 'tags'
+        if entry is None or entry['text'] != chunk or 'tags' not in entry:
+            return None
+        return entry['tags'], [tuple(m) for m in entry['mismatched']]
+
+    def record(self, chunk_num, chunk, tags, mismatched_words):
+        entry = {
+            'config': self.config_hash,
+            'chunk': chunk_num,
+            'text': chunk,
+            'tags': tags,
+            'mismatched': mismatched_words,
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.completed[chunk_num] = entry
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
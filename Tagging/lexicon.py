@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent lexicon of word forms and their tags, built from reference files
+(REF_Albuc_1.xlsx, NAF_reference.xlsx: Lemma/POS columns) and tagger outputs
+(*_tagged_*.xlsx: word/upos columns).
+
+Every source file is stored separately in the lexicon directory:
+
+    sources.json     name -> file, SHA-256, text, kind and token count
+    <name>.json      form -> {tag: count} of that source
+
+so a source is only read again when its file has changed, a finished run is
+added without touching the others, and the sources of one text can be left
+out. Leave out the text that is being tagged: its reference would otherwise
+leak into the tagger output that is evaluated against it.
+
+A form is known with confidence if it was seen at least min_count times and
+its most frequent tag has at least min_share of them. With a variant index
+(variant_index()), a form seen fewer times is also known if the tag counts of
+all its spellings pass the same test.
+"""
+import glob
+import json
+import os
+import re
+import sys
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from corpus_index import MISSING_CODE, TAG_CODES, UD_TAGS, file_sha256
+from variants import VariantIndex
+
+
+class Lexicon:
+    def __init__(self, lexicon_dir, min_count=20, min_share=0.95):
+        self.lexicon_dir = lexicon_dir
+        self.min_count = min_count  # occurrences of a form before it is trusted
+        self.min_share = min_share  # share of the most frequent tag among them
+        os.makedirs(lexicon_dir, exist_ok=True)
+        self.sources = {}
+        sources_file = os.path.join(lexicon_dir, 'sources.json')
+        if os.path.exists(sources_file):
+            with open(sources_file, 'r', encoding='utf-8') as f:
+                self.sources = json.load(f)
+        self._counts = {}  # name -> form -> Counter, read on demand
+
+    def _counts_file(self, name):
+        return os.path.join(self.lexicon_dir, re.sub(r'[^\w.-]', '_', name) + '.json')
+
+    def _save_sources(self):
+        with open(os.path.join(self.lexicon_dir, 'sources.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.sources, f, indent=2, ensure_ascii=False)
+
+    def add_file(self, file, text, name=None):
+        """
+        Add a reference or tagged xlsx file of the text `text` (e.g. "Albuc1").
+        Returns False if the same file content is already in the lexicon.
+        """
+        name = name or Path(file).stem
+        sha256 = file_sha256(file)
+        if self.sources.get(name, {}).get('sha256') == sha256:
+            return False
+        df = pd.read_excel(file, keep_default_na=False)
+        if 'upos' in df.columns:
+            words, tags, kind = df['word'], df['upos'], 'tagged'
+        else:
+            words, tags, kind = df['Lemma'], df['POS'], 'reference'
+        self.add_counts(name, words.astype(str), tags.astype(str), text, kind, file=file, sha256=sha256)
+        return True
+
+    def add_counts(self, name, words, tags, text, kind='tagged', file=None, sha256=None):
+        """Add (or replace) the source `name` from parallel word and tag sequences; tags outside UD are ignored."""
+        df = pd.DataFrame({'word': np.asarray(words, dtype=object), 'upos': np.asarray(tags, dtype=object)})
+        df = df[df['upos'].isin(UD_TAGS)]
+        counts = {}
+        for (word, tag), n in df.groupby(['word', 'upos'], sort=False).size().items():
+            counts.setdefault(word, {})[tag] = int(n)
+
+        with open(self._counts_file(name), 'w', encoding='utf-8') as f:
+            json.dump(counts, f, ensure_ascii=False)
+        # sources.json last: a source without an entry there is not used
+        self.sources[name] = {'file': file, 'sha256': sha256, 'text': text, 'kind': kind, 'tokens': len(df)}
+        self._save_sources()
+        self._counts[name] = {word: Counter(tag_counts) for word, tag_counts in counts.items()}
+
+    def remove(self, name):
+        if self.sources.pop(name, None) is not None:
+            self._save_sources()
+            self._counts.pop(name, None)
+            os.remove(self._counts_file(name))
+
+    def source_counts(self, name):
+        if name not in self._counts:
+            with open(self._counts_file(name), 'r', encoding='utf-8') as f:
+                self._counts[name] = {word: Counter(tag_counts) for word, tag_counts in json.load(f).items()}
+        return self._counts[name]
+
+    def distributions(self, exclude_texts=()):
+        """form -> Counter of tags over all sources except those of exclude_texts."""
+        total = {}
+        for name, source in self.sources.items():
+            if source['text'] in exclude_texts:
+                continue
+            for word, tag_counts in self.source_counts(name).items():
+                if word in total:
+                    total[word].update(tag_counts)
+                else:
+                    total[word] = Counter(tag_counts)
+        return total
+
+    def confident_tag(self, tag_counts, allowed_tags=None):
+        """(tag, share, count) if tag_counts make a form known with confidence, else None."""
+        count = sum(tag_counts.values())
+        if count < self.min_count:
+            return None
+        tag, top = tag_counts.most_common(1)[0]
+        if top / count >= self.min_share and (allowed_tags is None or tag in allowed_tags):
+            return tag, top / count, count
+        return None
+
+    def confident_tags(self, exclude_texts=(), allowed_tags=None):
+        """form -> (tag, share, count) of the forms known with confidence."""
+        table = {}
+        for word, tag_counts in self.distributions(exclude_texts).items():
+            known = self.confident_tag(tag_counts, allowed_tags)
+            if known is not None:
+                table[word] = known
+        return table
+
+    def variant_index(self, exclude_texts=(), forms=()):
+        """
+        VariantIndex of the lexicon forms and `forms` (e.g. the words of the
+        text to tag), with the tag evidence of the sources except those of exclude_texts.
+        """
+        distributions = self.distributions(exclude_texts)
+        counts = Counter(forms)
+        for word, tag_counts in distributions.items():
+            counts[word] += sum(tag_counts.values())
+        variants = VariantIndex.build(counts, counts=counts)
+        variants.set_evidence(distributions)
+        return variants
+
+    def pretag(self, corpus, exclude_texts=(), allowed_tags=None, variants=None):
+        """
+        Tag the words of a TaggedCorpus whose form is known with confidence;
+        with variants (see variant_index, same exclude_texts), forms seen
+        fewer than min_count times are tagged from their variant cluster.
+        Returns the boolean mask of the positions tagged from the lexicon.
+        """
+        distributions = self.distributions(exclude_texts)
+        form_ids, forms = pd.factorize(pd.Series(corpus.words, dtype=object))
+        form_codes = np.full(len(forms), MISSING_CODE, dtype=np.uint8)
+        for k, form in enumerate(forms):
+            tag_counts = distributions.get(form, Counter())
+            if variants is not None and sum(tag_counts.values()) < self.min_count:
+                tag_counts = variants.tag_evidence(form)
+            known = self.confident_tag(tag_counts, allowed_tags)
+            if known is not None:
+                form_codes[k] = TAG_CODES[known[0]]
+        codes = form_codes[form_ids]
+        known = codes != MISSING_CODE
+        corpus.tags[known] = codes[known]
+        return known
+
+if __name__ == "__main__":
+    lexicon = Lexicon(".lexicon")
+    # reference files and the texts they belong to
+    reference_files = {"../data/REF_Albuc_1.xlsx": "Albuc1",
+                       "../classification_report_agg/NAF_reference.xlsx": "NAF6195"}
+    # tagger outputs, the text is the part of the name before _tagged_
+    tagged_files = sorted(glob.glob("../Results - Albucasis/*_tagged_*.xlsx") +
+                          glob.glob("../Results - NAF6195/*_tagged_*.xlsx"))
+
+    added = 0
+    for file, text in reference_files.items():
+        added += lexicon.add_file(file, text)
+    for file in tagged_files:
+        added += lexicon.add_file(file, Path(file).name.split("_tagged_")[0])
+    print(f"{added} of {len(reference_files) + len(tagged_files)} sources added or updated in '{lexicon.lexicon_dir}'")
+    for text in sorted({source['text'] for source in lexicon.sources.values()}):
+        variants = lexicon.variant_index(exclude_texts=[text])
+        print(f"Without {text}: {len(lexicon.confident_tags(exclude_texts=[text]))} forms known with confidence, "
+              f"{len(variants.form_clusters)} forms in {len(variants.clusters)} variant clusters")
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+
+class ResponseCache:
+    """
+    Content-addressed on-disk cache for model responses.
+
+    Every entry is one JSON file named after the SHA-256 of the request
+    (model, prompt, chunk and generation options). When the cache grows
+    beyond max_bytes the least recently used entries are removed.
+    """
+
+    def __init__(self, cache_dir, max_bytes=2 * 1024 ** 3):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._size = sum(p.stat().st_size for p in self.cache_dir.glob('*.json'))
+
+    @staticmethod
+    def make_key(model, prompt, chunk, options):
+        payload = json.dumps({'model': model, 'prompt': prompt, 'chunk': chunk, 'options': options},
+                             sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return self.cache_dir / f"{key}.json"
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                response = json.load(f)
+            os.utime(path)  # mark as recently used for eviction
+        except (FileNotFoundError, json.JSONDecodeError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return response
+
+    def put(self, key, response):
+        path = self._path(key)
+        tmp_path = path.with_suffix(f'.{threading.get_ident()}.tmp')
+        data = json.dumps(response, ensure_ascii=False).encode('utf-8')
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        with self._lock:
+            old_size = path.stat().st_size if path.exists() else 0
+            os.replace(tmp_path, path)
+            self._size += len(data) - old_size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # drop least recently used entries until the cache is back to 90% of its limit
+        entries = sorted(self.cache_dir.glob('*.json'), key=lambda p: p.stat().st_mtime)
+        for path in entries:
+            if self._size <= self.max_bytes * 0.9:
+                break
+            size = path.stat().st_size
+            path.unlink(missing_ok=True)
+            self._size -= size
+
+    def stats(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0.0
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': hit_rate, 'size_bytes': self._size}
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import json
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+
+
+class RunLogger:
+    """
+    Single-writer log for one tagging run.
+
+    Problems are appended as JSON lines, responses in the usual
+    "--- Chunk i/n ---" text format (or as JSON lines with
+    responses_format="jsonl"), repair responses as "--- Repair i/n ---"
+    sections in repairs_file (the responses file if it is not set; the
+    file is only created once there is a repair). Callers on any thread only put lines on a
+    bounded queue; one writer thread owns both files and writes them through
+    large buffers, so memory does not grow with the corpus. Every problem is
+    counted per type; once keep_per_type entries of a type have been written,
+    further ones are only kept with probability sample_rate.
+    """
+
+    def __init__(self, problems_file, responses_file, responses_format="txt",
+                 keep_per_type=1000, sample_rate=1.0, quiet=False, progress_interval=5.0, repairs_file=None):
+        self.problems_file = problems_file
+        self.responses_file = responses_file
+        self.repairs_file = repairs_file
+        self.responses_format = responses_format
+        self.keep_per_type = keep_per_type
+        self.sample_rate = sample_rate
+        self.quiet = quiet
+        self.progress_interval = progress_interval
+        self.counts = {}
+        self.logged = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=10000)
+        self._closed = False
+        self._start_time = time.time()
+        self._last_progress = 0.0
+        self._progress_unit = "Chunks"
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def _write_loop(self):
+        files = {
+            'problems': open(self.problems_file, 'w', encoding='utf-8', buffering=1024 * 1024),
+            'responses': open(self.responses_file, 'a', encoding='utf-8', buffering=1024 * 1024),
+        }
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                target, text = item
+                if target not in files:
+                    files[target] = open(self.repairs_file, 'a', encoding='utf-8', buffering=1024 * 1024)
+                files[target].write(text)
+                if self._queue.empty():
+                    # nothing waiting: push the buffers out so a crash loses little
+                    for f in files.values():
+                        f.flush()
+        finally:
+            for f in files.values():
+                f.close()
+
+    def problem(self, problem_type, description, chunk_num=None, word=None, details=None):
+        with self._lock:
+            count = self.counts.get(problem_type, 0) + 1
+            self.counts[problem_type] = count
+            keep = count <= self.keep_per_type or random.random() < self.sample_rate
+            if keep:
+                self.logged[problem_type] = self.logged.get(problem_type, 0) + 1
+        if not keep:
+            return
+        entry = {
+            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'problem_type': problem_type,
+            'description': description,
+            'chunk_number': chunk_num,
+            'word': word,
+            'details': details,
+        }
+        self._put('problems', json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def _put(self, target, text):
+        # checked and queued under the lock, so nothing is queued after close() has stopped the writer
+        with self._lock:
+            if not self._closed:
+                self._queue.put((target, text))
+
+    def responses(self, chunk, chunk_num, total_chunks, responses):
+        if self.responses_format == "jsonl":
+            text = "".join(json.dumps({'chunk_number': chunk_num, 'total_chunks': total_chunks,
+                                       'input': chunk, 'response': r}, ensure_ascii=False) + "\n"
+                           for r in responses)
+        else:
+            text = "".join(f"\n\n--- Chunk {chunk_num}/{total_chunks} ---\nInput text: {chunk}\nResponse:\n{r}\n"
+                           for r in responses)
+        if text:
+            self._put('responses', text)
+
+    def repairs(self, requests, group_num, total_groups):
+        """(request, response) pairs of one repair window, in the text format of the repair log."""
+        text = "".join(f"\n\n--- Repair {group_num}/{total_groups} ---\nInput text: {request}\nResponse:\n{r}\n"
+                       for request, r in requests)
+        if text:
+            self._put('repairs' if self.repairs_file else 'responses', text)
+
+    def progress(self, done, total, force=False, unit="Chunks"):
+        """Rate-limited progress line with ETA, only shown in quiet mode."""
+        if not self.quiet:
+            return
+        now = time.time()
+        if unit != self._progress_unit:
+            # a new phase (e.g. repairs after the chunks): elapsed time and ETA start again
+            self._progress_unit = unit
+            self._start_time = now
+            self._last_progress = 0.0
+        if not force and now - self._last_progress < self.progress_interval and done < total:
+            return
+        self._last_progress = now
+        elapsed = now - self._start_time
+        eta = elapsed / done * (total - done) if done else 0.0
+        problems = sum(self.counts.values())
+        sys.stdout.write(f"\r{unit} {done}/{total} ({done / total:.0%}), elapsed {elapsed:.0f} s, "
+                         f"ETA {eta:.0f} s, {problems} problems")
+        if done >= total:
+            sys.stdout.write("\n")
+        sys.stdout.flush()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+
+    def iter_problems(self, problem_type=None):
+        """Read logged problems back from the JSONL file (after close())."""
+        with open(self.problems_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                if problem_type is None or entry['problem_type'] == problem_type:
+                    yield entry
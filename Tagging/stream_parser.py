@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+import json
+import string
+import unicodedata
+
+
+def normalize_word(word):
+    """
+    Matching key for a word: case-folded, without diacritics and without
+    punctuation around it (punctuation-only tokens are kept as they are).
+    """
+    key = unicodedata.normalize('NFKD', str(word).casefold())
+    key = ''.join(c for c in key if not unicodedata.combining(c))
+    stripped = key.strip(string.punctuation + '«»“”‘’·')
+    return stripped or key
+
+
+def common_subsequence(a, b):
+    """
+    Index pairs (i, j), in order, of a longest common subsequence of the
+    sequences a and b (e.g. normalize_word keys of the input words and of
+    the words of the answer). A shared beginning and end are matched
+    directly; only the part in between goes through the dynamic program.
+    """
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end_a, end_b = len(a), len(b)
+    while end_a > start and end_b > start and a[end_a - 1] == b[end_b - 1]:
+        end_a -= 1
+        end_b -= 1
+
+    middle_a, middle_b = a[start:end_a], b[start:end_b]
+    n, m = len(middle_a), len(middle_b)
+    # lengths[i][j]: length of a longest common subsequence of middle_a[i:] and middle_b[j:]
+    lengths = [[0] * (m + 1) for _ in range(n + 1)]
+    for i in range(n - 1, -1, -1):
+        row, below, x = lengths[i], lengths[i + 1], middle_a[i]
+        for j in range(m - 1, -1, -1):
+            row[j] = below[j + 1] + 1 if x == middle_b[j] else max(below[j], row[j + 1])
+
+    pairs = [(k, k) for k in range(start)]
+    i = j = 0
+    while i < n and j < m:
+        if middle_a[i] == middle_b[j]:
+            pairs.append((start + i, start + j))
+            i += 1
+            j += 1
+        elif lengths[i + 1][j] >= lengths[i][j + 1]:
+            i += 1
+        else:
+            j += 1
+    pairs.extend((end_a + k, end_b + k) for k in range(len(a) - end_a))
+    return pairs
+
+
+class StreamingTagParser:
+    """
+    Incrementally parse a streamed JSON array of {"word", "upos"} objects and
+    check every object against the words of the input chunk.
+
+    feed() returns "complete" once every input word has been tagged,
+    "diverged" once the output clearly no longer follows the input, and None
+    while more text is needed. Text before the array (e.g. "Tags [UD]: ") is
+    skipped; "unparsed" means the output is not a plain array of objects,
+    the rest of the stream is then only collected for the regular parser.
+    Words are compared on normalize_word keys, as in reconcile_tags. An
+    output word matches an input word up to `lookahead` positions ahead of
+    the last match; a word up to `lookahead` positions behind it (a repeated
+    word, or words the model is still catching up on after a match that
+    jumped ahead) is no miss either.
+    """
+
+    def __init__(self, expected_words, lookahead=10, max_consecutive_misses=10, max_extra_objects=5):
+        self.expected = [normalize_word(w) for w in expected_words]
+        self.lookahead = lookahead
+        self.max_consecutive_misses = max_consecutive_misses
+        self.max_extra_objects = max_extra_objects
+        self.text = ""
+        self.objects = []
+        self.start_pos = None  # position of the '[' of the array in self.text
+        self.end_pos = 0  # end of the last complete object in self.text
+        self._pos = None  # parse position inside the array, None until '[' is seen
+        self._search_pos = 0  # where to look for the next '['
+        self._next_word = 0
+        self._misses = 0
+        self._decoder = json.JSONDecoder()
+        self.status = None
+
+    def feed(self, piece):
+        self.text += piece
+        if self.status is not None:
+            return self.status
+
+        while self.status is None:
+            if self._pos is None:
+                start = self.text.find('[', self._search_pos)
+                if start == -1:
+                    self._search_pos = len(self.text)
+                    break
+                self.start_pos, self._pos = start, start + 1
+            while self._pos < len(self.text) and self.text[self._pos] in ' \t\r\n,':
+                self._pos += 1
+            if self._pos >= len(self.text):
+                break
+            char = self.text[self._pos]
+            if char == ']' and self.objects:
+                self.status = "complete"
+                break
+            if char != '{':
+                if self.objects:
+                    # not a plain array of objects, leave it to the regular parser
+                    self.status = "unparsed"
+                    break
+                # a '[' in the text before the array ("Tags [UD]:") or an outer array, try the next one
+                self._search_pos, self._pos = self.start_pos + 1, None
+                continue
+            try:
+                obj, end = self._decoder.raw_decode(self.text, self._pos)
+            except json.JSONDecodeError:
+                break  # object not complete yet
+            self._pos = self.end_pos = end
+            self._check(obj)
+        return self.status
+
+    def _check(self, obj):
+        self.objects.append(obj)
+        word = normalize_word(obj.get('word', '')) if isinstance(obj, dict) else None
+        ahead = self.expected[self._next_word:self._next_word + self.lookahead + 1]
+        behind = self.expected[max(0, self._next_word - self.lookahead):self._next_word]
+        if word in ahead:
+            self._next_word += ahead.index(word) + 1
+            self._misses = 0
+        elif word in behind:
+            self._misses = 0
+        else:
+            self._misses += 1
+
+        # the last word alone could be matched early (e.g. a "."), so the output must also be long enough
+        if self._next_word >= len(self.expected) and len(self.objects) >= len(self.expected):
+            self.status = "complete"
+        elif (self._misses >= self.max_consecutive_misses
+              or len(self.objects) > len(self.expected) + self.max_extra_objects):
+            self.status = "diverged"
+
+    def result_text(self):
+        """Text of the array up to the last complete object, closed with ']'."""
+        if self._pos is None or not self.objects:
+            return self.text
+        return self.text[self.start_pos:self.end_pos] + "\n]"
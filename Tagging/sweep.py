@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Run a grid of models x prompts x texts with as few model swaps as possible.
+
+All jobs of one model run back to back while the server keeps the model
+loaded (keep_alive), then the model is unloaded before the next one is
+loaded. Every cell writes the same files as a single run of tagging.py;
+cells whose *_tagged_*.xlsx already exists are skipped.
+
+Usage: python sweep.py [grid.json]
+
+The grid file has the same keys as DEFAULT_GRID. A prompt given as null
+uses the prompt defined in OccPoSTagger, any other value is the path of a
+text file holding the prompt, e.g.
+
+    "prompts": {"zero_shot": "prompts/zero_shot.txt", "prompt2": null}
+
+lexicon is the directory of a lexicon built with lexicon.py, or null.
+"""
+import json
+import sys
+from pathlib import Path
+
+import ollama
+
+from backends import BackendPool
+from lexicon import Lexicon
+from response_cache import ResponseCache
+from tagging import OccPoSTagger, output_file_name, run_prompt_name, run_tagging
+
+DEFAULT_GRID = {
+    "models": ["aya", "gemma2:9b", "mistral", "mistral-nemo", "mixtral", "phi4", "qwen2.5:14b"],
+    "prompts": {"prompt2": None},  # other prompts as text files, see above
+    "texts": ["./Albuc1.txt", "./NAF6195.txt"],
+    "keep_alive": "30m",
+    "hosts": [],  # several Ollama servers to spread chunks over, empty for the default host
+    "num_parallel": 1,
+    "structured_output": False,
+    "lexicon": None,
+    "variants": False,
+}
+
+
+def load_prompts(prompt_spec, default_prompt):
+    prompts = {}
+    for prompt_name, prompt_file in prompt_spec.items():
+        if prompt_file is None:
+            prompts[prompt_name] = default_prompt
+            continue
+        try:
+            with open(prompt_file, 'r', encoding='utf-8') as f:
+                prompts[prompt_name] = f.read()
+        except FileNotFoundError:
+            print(f"Error: Prompt file '{prompt_file}' for '{prompt_name}' not found.")
+            sys.exit(1)
+    return prompts
+
+
+def schedule_jobs(grid, tagger):
+    """
+    Order the grid cells so every model is loaded once: all prompts and
+    texts of a model run back to back. Finished cells (named as
+    run_tagging names them for the tagger's output mode) are left out.
+    """
+    jobs = []
+    for model_name in grid["models"]:
+        for prompt_name in grid["prompts"]:
+            for input_file in grid["texts"]:
+                if Path(output_file_name(input_file, model_name, run_prompt_name(tagger, prompt_name))).exists():
+                    print(f"Skipping {model_name} / {prompt_name} / {input_file}: output already exists")
+                    continue
+                jobs.append((model_name, prompt_name, input_file))
+    return jobs
+
+
+def unload_model(tagger, model_name):
+    if tagger.backend is not None:
+        tagger.backend.unload_model(model_name)
+        return
+    try:
+        ollama.generate(model=model_name, keep_alive=0)
+    except Exception as e:
+        print(f"Could not unload model '{model_name}': {str(e)}")
+
+
+def run_sweep(grid):
+    tagger = OccPoSTagger()
+    tagger.cache = ResponseCache(".response_cache")
+    tagger.keep_alive = grid.get("keep_alive", "30m")
+    tagger.num_parallel = grid.get("num_parallel", 1)
+    if grid.get("hosts"):
+        tagger.backend = BackendPool(grid["hosts"])
+    tagger.structured_output = grid.get("structured_output", False)
+    if grid.get("lexicon"):
+        tagger.lexicon = Lexicon(grid["lexicon"])
+        tagger.variants = grid.get("variants", False)
+    prompts = load_prompts(grid["prompts"], tagger.prompt)
+
+    jobs = schedule_jobs(grid, tagger)
+    print(f"{len(jobs)} runs for {len({job[0] for job in jobs})} models")
+
+    loaded_model = None
+    for job_num, (model_name, prompt_name, input_file) in enumerate(jobs, 1):
+        if model_name != loaded_model:
+            if loaded_model is not None:
+                unload_model(tagger, loaded_model)
+            loaded_model = model_name
+
+        print(f"\n=== Run {job_num}/{len(jobs)}: model '{model_name}', prompt '{prompt_name}', text '{input_file}' ===")
+        tagger.model_name = model_name
+        tagger.prompt = prompts[prompt_name]
+        run_tagging(tagger, input_file, prompt_name=prompt_name)
+
+    if loaded_model is not None:
+        unload_model(tagger, loaded_model)
+
+
+def main():
+    grid = DEFAULT_GRID
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'r', encoding='utf-8') as f:
+            grid = json.load(f)
+    run_sweep(grid)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory corpus of the tagger: the tokens of one text with one uint8 tag
+code per token (codes of corpus_index, MISSING_CODE until a chunk is
+tagged). Chunks are views on a token range, so the words and tags of a chunk
+are slices of the corpus arrays, and a tagged chunk writes its codes straight
+into the corpus.
+"""
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from corpus_index import MISSING_CODE, decode_tags, encode_tags
+
+
+class ChunkView:
+    """Tokens start:end of a TaggedCorpus."""
+    __slots__ = ('corpus', 'start', 'end')
+
+    def __init__(self, corpus, start, end):
+        self.corpus = corpus
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    @property
+    def words(self):
+        return self.corpus.words[self.start:self.end]
+
+    @property
+    def tags(self):
+        return self.corpus.tags[self.start:self.end]
+
+    @property
+    def text(self):
+        """The chunk as sent to the model: its words joined by spaces."""
+        return ' '.join(self.words)
+
+    def tag_strings(self):
+        return decode_tags(self.tags)
+
+
+class TaggedCorpus:
+    __slots__ = ('words', 'tags', 'sentence_starts', 'sentence_lengths')
+
+    def __init__(self, words, tags=None, sentence_starts=None, sentence_lengths=None):
+        self.words = words if isinstance(words, np.ndarray) else np.array(words, dtype=object)
+        if tags is None:
+            self.tags = np.full(len(self.words), MISSING_CODE, dtype=np.uint8)
+        else:
+            self.tags = encode_tags(tags)
+        if sentence_lengths is None:
+            # the whole text as one sentence
+            sentence_starts, sentence_lengths = [0], [len(self.words)]
+        self.sentence_starts = np.asarray(sentence_starts, dtype=np.int64)
+        self.sentence_lengths = np.asarray(sentence_lengths, dtype=np.int64)
+
+    @classmethod
+    def from_index(cls, index):
+        """
+        Untagged corpus of an indexed text (corpus_index.load_index). Equal
+        word forms share one string object.
+        """
+        return cls(index.words(), sentence_starts=index.sentence_starts, sentence_lengths=index.sentence_lengths)
+
+    @classmethod
+    def from_text(cls, text):
+        """Untagged corpus of a text with one sentence per line."""
+        words = []
+        starts = []
+        lengths = []
+        for line in text.splitlines():
+            sentence = line.split()
+            starts.append(len(words))
+            lengths.append(len(sentence))
+            words.extend(sentence)
+        return cls(words, sentence_starts=starts, sentence_lengths=lengths)
+
+    def __len__(self):
+        return len(self.words)
+
+    def view(self, start=0, end=None):
+        return ChunkView(self, start, len(self.words) if end is None else end)
+
+    def views(self, cuts):
+        """Chunk views between consecutive positions of cuts (e.g. [0, 50, 100, n])."""
+        return [ChunkView(self, start, end) for start, end in zip(cuts[:-1], cuts[1:])]
+
+    def tag_strings(self):
+        return decode_tags(self.tags)
+
+    def nonempty_sentence_lengths(self):
+        return self.sentence_lengths[self.sentence_lengths > 0]
@@ -2,18 +2,92 @@
 import json
 import sys
 import re
+import signal
 import time
+import threading
+import numpy as np
 import ollama
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
 from pathlib import Path
 
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from corpus_index import MISSING_CODE, TAG_CODES, decode_tags, encode_tags, load_index
+from checkpoint import ChunkCheckpoint
+from response_cache import ResponseCache
+from run_log import RunLogger
+from stream_parser import StreamingTagParser, common_subsequence, normalize_word
+from tagged_corpus import TaggedCorpus
+from writers import open_outputs
+
+# words or single symbols, used for token estimates
+TOKEN_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+# JSON overhead per tagged word in the answer, without the word itself
+OUTPUT_TOKENS_PER_WORD = 12
+# position number of a word in the numbered list of a targeted request (and in its answer)
+INDEX_TOKENS = 2
+
+# timings reported by the server for every request (durations in nanoseconds)
+TELEMETRY_FIELDS = ("total_duration", "load_duration", "prompt_eval_count",
+                    "prompt_eval_duration", "eval_count", "eval_duration")
+
+# fields of an ollama response that are kept in the response cache
+RESPONSE_FIELDS = ("response", "total_duration", "load_duration", "prompt_eval_count",
+                   "prompt_eval_duration", "eval_count", "eval_duration")
+
 class OccPoSTagger:
     def __init__(self):
         self.model_name = "mistral" #model name
         self.ctx = 8196
+        self.keep_alive = None  # how long the server keeps the model loaded after a request, e.g. "30m"
+        self.chunk_token_budget = 2048  # estimated prompt + chunk + answer tokens per request
         self.ud_tags = {"ADJ", "ADP", "ADV", "AUX", "CCONJ", "DET", "INTJ", "NOUN", "NUM", "PRON", "PROPN", "PUNCT", "SCONJ", "VERB", "X"}
+        '''adapt the prompt'''
+        self.prompt = """You are a medieval Occitan language expert specializing in linguistic analysis. This language is related to Catalan and Latin. In this text there is a high variety of spelling variations having the same meaning.
+                This is an example for spelling variation: homps, ome, om, omen, omne, hom, home. Another example is: acayson, achaison, acheison, acheson, aqueison, caiso, caison, cason, cayson, chaizo, queison or gaug, gauc, gautz, jau, jauvi.
+                Your task is to analyze the given text and assign Universal Dependencies Part-of-Speech (UD POS) tags to each word.
+                Return the results as a JSON array of objects, each containing only the 'word' and 'upos' keys.
+                Ensure that the JSON array is properly formatted and closed.
+                The output must be only the JSON array without any additional text, explanations, or formatting
+                """
+        self.repair_prompt = """You are a medieval Occitan language expert specializing in linguistic analysis. This language is related to Catalan and Latin. In this text there is a high variety of spelling variations having the same meaning.
+                You get a numbered list of words from the text and the positions of the words that still need a Universal Dependencies Part-of-Speech (UD POS) tag. Use the other words only as context.
+                Return the results as a JSON array with one object per requested position, each containing only the 'index', 'word' and 'upos' keys.
+                The output must be only the JSON array without any additional text, explanations, or formatting
+                """
+        # appended to self.prompt for chunks of which only some words are sent to be tagged (lexicon mode)
+        self.target_instructions = """This time you get the text as a numbered list of words and the positions of the words to tag; the other words are already tagged and are only context.
+                Instead of one object per word, return one object per requested position, each containing only the 'index', 'word' and 'upos' keys.
+                """
+        self.output_formats = ["xlsx"]  # any of "xlsx", "parquet" (needs pyarrow), "conllu"
+        self.repair_missing_tags = False  # re-query words left without a valid tag at the end of a run
+        self.lexicon = None  # optional Lexicon: known forms are tagged locally, only the other positions of a chunk are sent to the model
+        self.variants = False  # with a lexicon, rare forms are also tagged from the evidence of their spelling variants
+        self.problems_log = []
+        self.run_log = None  # optional RunLogger, problems and responses are then streamed to disk
+        self.quiet = False  # only print a progress line instead of every chunk and response
+        self.stream = False  # parse the response while it is generated and abort early
+        self.structured_output = False  # constrain the output with a JSON schema instead of free-form prompting
+        self.prefix_mode = None  # None, "system" or "context": send the prompt as a reusable prefix
+        self.chunk_stats = []
+        self.attempt_stats = []  # one row per request, see save_metrics
+        self.cache = None  # optional ResponseCache, e.g. ResponseCache(".response_cache")
+        self.backend = None  # optional BackendPool, e.g. BackendPool(["http://box1:11434", "http://box2:11434"])
+        self.num_parallel = 1  # chunk requests kept in flight, should match OLLAMA_NUM_PARALLEL of the server
+        self.checkpoint = None  # optional ChunkCheckpoint, finished chunks are skipped on restart
+        self.stop_requested = False
+        self._lock = threading.Lock()
+        self._prefix_lock = threading.Lock()
+        self._prefix_contexts = {}
+
+    def reset_run_state(self):
         self.problems_log = []
+        self.run_log = None
+        self.chunk_stats = []
+        self.attempt_stats = []
+        self.checkpoint = None
+        self.stop_requested = False
 
     def log_problem(self, problem_type, description, chunk_num=None, word=None, details=None):
         problem = {
@@ -24,16 +98,41 @@ class OccPoSTagger:
             'word': word,
             'details': details
         }
-        self.problems_log.append(problem)
+        if self.run_log is not None:
+            self.run_log.problem(problem_type, description, chunk_num=chunk_num, word=word, details=details)
+            return
+        with self._lock:
+            self.problems_log.append(problem)
+
+    def _print(self, *args):
+        # per-chunk output, replaced by the progress line in quiet mode
+        if not self.quiet:
+            print(*args)
 
     def save_problems_log(self, output_file):
+        """
+        Write the grouped, human-readable problem log. With a RunLogger the
+        JSONL problem file is closed first and read back one problem type
+        at a time, so nothing has to be held in memory.
+        """
         try:
             with open(output_file, 'w', encoding='utf-8') as f:
                 f.write("=== OCCITAN PoS TAGGER PROBLEM LOG ===\n")
                 f.write(f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+
+                if self.run_log is not None:
+                    run_log = self.run_log
+                    run_log.close()
+                    for prob_type, count in run_log.counts.items():
+                        logged = run_log.logged.get(prob_type, 0)
+                        f.write(f"\n=== {prob_type.upper()} === ({count} occurrences, {logged} logged)\n")
+                        for problem in run_log.iter_problems(prob_type):
+                            self._write_problem(f, problem)
+                    return
                 
+                # chunks may finish out of order when several are in flight
                 problem_types = {}
-                for problem in self.problems_log:
+                for problem in sorted(self.problems_log, key=lambda p: p['chunk_number'] or 0):
                     prob_type = problem['problem_type']
                     if prob_type not in problem_types:
                         problem_types[prob_type] = []
@@ -42,24 +141,28 @@ class OccPoSTagger:
                 for prob_type, problems in problem_types.items():
                     f.write(f"\n=== {prob_type.upper()} ===\n")
                     for problem in problems:
-                        f.write(f"\nTime: {problem['timestamp']}")
-                        if problem['chunk_number'] is not None:
-                            f.write(f"\nChunk: {problem['chunk_number']}")
-                        if problem['word'] is not None:
-                            f.write(f"\nWord: {problem['word']}")
-                        f.write(f"\nDescription: {problem['description']}")
-                        if problem['details']:
-                            f.write(f"\nDetails: {problem['details']}")
-                        f.write("\n" + "-"*50 + "\n")
+                        self._write_problem(f, problem)
 
         except Exception as e:
             print(f"Error saving problems log: {str(e)}")
             self.log_problem("LOG_SAVE_ERROR", "Failed to save problems log", details=str(e))
 
-    def read_text_file(self, file_path):
+    @staticmethod
+    def _write_problem(f, problem):
+        f.write(f"\nTime: {problem['timestamp']}")
+        if problem['chunk_number'] is not None:
+            f.write(f"\nChunk: {problem['chunk_number']}")
+        if problem['word'] is not None:
+            f.write(f"\nWord: {problem['word']}")
+        f.write(f"\nDescription: {problem['description']}")
+        if problem['details']:
+            f.write(f"\nDetails: {problem['details']}")
+        f.write("\n" + "-"*50 + "\n")
+
+    def read_text_index(self, file_path):
+        """Corpus index of a text file (see corpus_index.load_index); a missing or unreadable file ends the run."""
         try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                return file.read()
+            return load_index(file_path)
         except FileNotFoundError:
             self.log_problem("FILE_ERROR", f"Input file '{file_path}' not found")
             print(f"Error: Input file '{file_path}' not found.")
@@ -69,39 +172,253 @@ class OccPoSTagger:
             print(f"Error reading file '{file_path}': {str(e)}")
             sys.exit(1)
 
-    def build_chunks(self, text, chunk_size=50):
-        words = text.split()
-        chunks = [' '.join(words[i:i + chunk_size]) for i in range(0, len(words), chunk_size)]
-        return chunks, words
+    def build_chunks(self, corpus, chunk_size=50):
+        """Fixed chunks of chunk_size words, as views on the TaggedCorpus."""
+        cuts = list(range(0, len(corpus), chunk_size)) + [len(corpus)]
+        return corpus.views(cuts)
+
+    @staticmethod
+    def estimate_tokens(text):
+        # rough subword estimate: one token per started group of 4 characters of every word or symbol
+        return sum((len(piece) + 3) // 4 for piece in TOKEN_PIECE_RE.findall(text))
+
+    def estimate_chunk_tokens(self, words, targets=None):
+        """
+        Estimated prompt + chunk + JSON answer tokens for one request; with
+        targets (boolean mask over the words) only those words are answered.
+        """
+        prompt = self.prompt if targets is None else self.target_prompt()
+        return self.estimate_tokens(prompt) + sum(self.word_tokens(words, targets))
+
+    def word_tokens(self, words, targets=None):
+        """Estimated request + answer tokens of every word, see estimate_chunk_tokens."""
+        form_tokens = {}  # estimate once per word form
+        for word in words:
+            if word not in form_tokens:
+                form_tokens[word] = self.estimate_tokens(word)
+        if targets is None:
+            return [form_tokens[word] * 2 + OUTPUT_TOKENS_PER_WORD for word in words]
+        return [form_tokens[word] * 2 + OUTPUT_TOKENS_PER_WORD + 2 * INDEX_TOKENS if target
+                else form_tokens[word] + INDEX_TOKENS
+                for word, target in zip(words, targets)]
+
+    def build_sentence_chunks(self, corpus, token_budget=None, targets=None):
+        """
+        Pack whole sentences (one per line, as in Albuc1.txt and NAF6195.txt)
+        of the TaggedCorpus into chunks whose estimated prompt + chunk +
+        answer size stays within token_budget (default
+        self.chunk_token_budget, never more than self.ctx). A sentence that
+        does not fit on its own is split at word boundaries. With targets
+        (boolean mask over the corpus) only those words are answered, so
+        the chunks hold more words. Returns chunk views like build_chunks.
+        """
+        budget = min(token_budget or self.chunk_token_budget, self.ctx)
+        fixed_tokens = self.estimate_tokens(self.prompt if targets is None else self.target_prompt())
+        if fixed_tokens >= budget:
+            raise ValueError(f"Token budget {budget} is smaller than the prompt ({fixed_tokens} tokens)")
+
+        word_tokens = self.word_tokens(corpus.words, targets)
+
+        # chunks are consecutive token ranges, so only the cut positions are kept
+        cuts = [0]
+        current_tokens = fixed_tokens
+        for start, length in zip(corpus.sentence_starts.tolist(), corpus.sentence_lengths.tolist()):
+            if not length:
+                continue
+            end = start + length
+            sentence_tokens = sum(word_tokens[start:end])
+            if start > cuts[-1] and current_tokens + sentence_tokens > budget:
+                cuts.append(start)
+                current_tokens = fixed_tokens
+
+            if current_tokens + sentence_tokens <= budget:
+                current_tokens += sentence_tokens
+                continue
+
+            # sentence longer than the whole budget
+            for position in range(start, end):
+                if position > cuts[-1] and current_tokens + word_tokens[position] > budget:
+                    cuts.append(position)
+                    current_tokens = fixed_tokens
+                current_tokens += word_tokens[position]
+
+        if len(corpus) > cuts[-1]:
+            cuts.append(len(corpus))
+        return corpus.views(cuts)
+
+    def chunk_statistics(self, chunks, targets=None):
+        """Request count versus context length for a list of chunks (targets as for build_sentence_chunks)."""
+        sizes = [len(chunk) for chunk in chunks]
+        tokens = [self.estimate_chunk_tokens(chunk.words, None if targets is None else targets[chunk.start:chunk.end])
+                  for chunk in chunks]
+        if not chunks:
+            return {'chunks': 0}
+        prompt_tokens = self.estimate_tokens(self.prompt if targets is None else self.target_prompt())
+        return {
+            'chunks': len(chunks),
+            'words': sum(sizes),
+            'min_words': min(sizes),
+            'mean_words': sum(sizes) / len(sizes),
+            'max_words': max(sizes),
+            'mean_tokens': sum(tokens) / len(tokens),
+            'max_tokens': max(tokens),
+            'total_tokens': sum(tokens),
+            'instruction_tokens': prompt_tokens * len(chunks),  # spent on repeating the prompt
+        }
 
     def process_chunk(self, chunk, chunk_num, total_chunks, log_file, retries=3, backoff=2):
-        print(f"\nProcessing chunk {chunk_num}/{total_chunks}")
-        print("Input chunk words:", chunk)
+        """Tag one chunk view; its tag codes are written into the corpus."""
+        codes, mismatched_words, responses = self.tag_chunk(chunk, chunk_num, total_chunks, retries, backoff)
+        self.write_responses(log_file, chunk.text, chunk_num, total_chunks, responses)
+        if codes is not None:
+            chunk.tags[:] = codes
+        return codes, mismatched_words
+
+    def process_chunks(self, chunks, log_file, keep=None):
+        """
+        Tag all chunk views and yield (chunk, mismatched_words) in chunk order,
+        after the tag codes of the chunk have been written into the corpus (a
+        failed chunk keeps MISSING_CODE). With num_parallel > 1 up to that many requests are kept in flight; the
+        responses log is still written in chunk order. Chunks found in
+        self.checkpoint are not sent again, and after request_stop() no new
+        chunks are started. keep (boolean mask over the corpus, e.g. the
+        positions tagged from the lexicon) marks tags that are not
+        overwritten: only the other words of a chunk are sent as targets
+        (see tag_chunk), and chunks that are kept completely are not sent.
+        """
+        total_chunks = len(chunks)
+        with ThreadPoolExecutor(max_workers=max(1, self.num_parallel)) as executor:
+            running = {}
+            finished = {}
+            next_submit = 1
+            next_yield = 1
+            while next_yield <= total_chunks:
+                while next_submit <= total_chunks and len(running) < max(1, self.num_parallel) and not self.stop_requested:
+                    chunk = chunks[next_submit - 1]
+                    stored = self.checkpoint.get(next_submit, chunk.text) if self.checkpoint is not None else None
+                    if keep is not None and keep[chunk.start:chunk.end].all():
+                        finished[next_submit] = (None, [], [])
+                    elif stored is not None:
+                        finished[next_submit] = (encode_tags(stored[0]), stored[1], [])
+                    else:
+                        targets = None if keep is None else ~keep[chunk.start:chunk.end]
+                        future = executor.submit(self._run_chunk, chunk, next_submit, total_chunks, targets)
+                        running[future] = next_submit
+                    next_submit += 1
+
+                if running:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        finished[running.pop(future)] = future.result()
+                elif next_yield not in finished:
+                    # stop requested and nothing left in flight
+                    return
+
+                while next_yield in finished:
+                    codes, mismatched_words, responses = finished.pop(next_yield)
+                    chunk = chunks[next_yield - 1]
+                    if responses:
+                        self.write_responses(log_file, chunk.text, next_yield, total_chunks, responses)
+                    if codes is not None:
+                        if keep is None:
+                            chunk.tags[:] = codes
+                        else:
+                            model_tagged = ~keep[chunk.start:chunk.end]
+                            chunk.tags[model_tagged] = codes[model_tagged]
+                    yield chunk, mismatched_words
+                    if self.run_log is not None:
+                        self.run_log.progress(next_yield, total_chunks)
+                    next_yield += 1
+
+    def _run_chunk(self, chunk, chunk_num, total_chunks, targets=None):
+        codes, mismatched_words, responses = self.tag_chunk(chunk, chunk_num, total_chunks, targets=targets)
+        if self.checkpoint is not None and codes is not None:
+            self.checkpoint.record(chunk_num, chunk.text, decode_tags(codes).tolist(), mismatched_words)
+        return codes, mismatched_words, responses
+
+    def request_stop(self, signum=None, frame=None):
+        """
+        SIGINT handler: finish the chunks in flight, then stop. A second
+        Ctrl-C raises KeyboardInterrupt, so the outputs are not written; the
+        requests already sent are still waited for (and checkpointed).
+        """
+        print("\nInterrupt received, finishing chunks in flight "
+              "(press Ctrl-C again to stop without writing the outputs; requests already sent still finish)...")
+        self.stop_requested = True
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    def write_responses(self, log_file, chunk, chunk_num, total_chunks, responses):
+        if self.run_log is not None:
+            self.run_log.responses(chunk, chunk_num, total_chunks, responses)
+            return
+        with open(log_file, 'a', encoding='utf-8') as f:
+            for response_content in responses:
+                f.write(f"\n\n--- Chunk {chunk_num}/{total_chunks} ---\n")
+                f.write(f"Input text: {chunk}\n")
+                f.write(f"Response:\n{response_content}\n")
+
+    def write_repairs(self, log_file, group_num, total_groups, responses):
+        """(request, response) pairs of one repair window, through the run log if there is one."""
+        if self.run_log is not None:
+            self.run_log.repairs(responses, group_num, total_groups)
+            return
+        if not log_file or not responses:
+            return
+        with open(log_file, 'a', encoding='utf-8') as f:
+            for request, response_content in responses:
+                f.write(f"\n\n--- Repair {group_num}/{total_groups} ---\n")
+                f.write(f"Input text: {request}\n")
+                f.write(f"Response:\n{response_content}\n")
+
+    def tag_chunk(self, chunk, chunk_num, total_chunks, retries=3, backoff=2, targets=None):
+        """
+        Tag one chunk view. Returns (uint8 tag codes of its words or None if
+        every attempt failed, mismatched words, raw responses); the corpus
+        itself is not changed here. With targets (boolean mask over the
+        words of the chunk) the chunk is sent as a numbered list with
+        self.target_prompt() and only the target positions are asked for
+        and get a tag code; the other words are context.
+        """
+        text = chunk.text
+        self._print(f"\nProcessing chunk {chunk_num}/{total_chunks}")
+        self._print("Input chunk words:", text)
+
+        original_words = chunk.words
+        if targets is None:
+            positions = list(range(len(original_words)))
+            request, prompt = text, None
+        else:
+            positions = np.flatnonzero(targets).tolist()
+            request = self.indexed_request(original_words, 0, len(original_words), positions)
+            prompt = self.target_prompt()
         
         mismatched_words = []
+        responses = []
+        chunk_start = time.time()
+        prompt_eval = {'count': 0, 'duration': 0}
 
         for attempt in range(retries):
-            '''adapt the prompt'''
+            attempt_start = time.time()
+            response = None
             try:
-                prompt = """You are a medieval Occitan language expert specializing in linguistic analysis. This language is related to Catalan and Latin. In this text there is a high variety of spelling variations having the same meaning.
-                This is an example for spelling variation: homps, ome, om, omen, omne, hom, home. Another example is: acayson, achaison, acheison, acheson, aqueison, caiso, caison, cason, cayson, chaizo, queison or gaug, gauc, gautz, jau, jauvi.
-                Your task is to analyze the given text and assign Universal Dependencies Part-of-Speech (UD POS) tags to each word.
-                Return the results as a JSON array of objects, each containing only the 'word' and 'upos' keys.
-                Ensure that the JSON array is properly formatted and closed.
-                The output must be only the JSON array without any additional text, explanations, or formatting
-                """
-
-                response = ollama.generate(model=self.model_name, 
-                                            prompt=prompt + "\n" + chunk, 
-                                            options={"num_ctx": self.ctx})
+                response = self._generate(request, use_cache=attempt == 0, prompt=prompt,
+                                          num_targets=None if targets is None else len(positions))
 
                 response_content = response['response']
-                print("Response model: ", response_content)
-                
-                with open(log_file, 'a', encoding='utf-8') as f:
-                    f.write(f"\n\n--- Chunk {chunk_num}/{total_chunks} ---\n")
-                    f.write(f"Input text: {chunk}\n")
-                    f.write(f"Response:\n{response_content}\n")
+                self._print("Response model: ", response_content)
+                responses.append(response_content)
+                if not response.get('cached'):
+                    prompt_eval['count'] += response.get('prompt_eval_count') or 0
+                    prompt_eval['duration'] += response.get('prompt_eval_duration') or 0
+                    self._print(f"Prompt eval: {response.get('prompt_eval_count')} tokens in "
+                          f"{(response.get('prompt_eval_duration') or 0) / 1e6:.0f} ms")
+
+                if response.get('done_reason') == "diverged":
+                    # the words tagged before the divergence are still used, the rest stays untagged
+                    self.log_problem("STREAM_DIVERGED",
+                                   "Streamed output stopped following the input words, generation aborted",
+                                   chunk_num=chunk_num,
+                                   details=response_content)
 
                 json_str = self._extract_json(response_content)
                 if not json_str:
@@ -109,6 +426,7 @@ class OccPoSTagger:
                                    "Failed to extract JSON from response",
                                    chunk_num=chunk_num,
                                    details=response_content)
+                    self._record_attempt(chunk_num, attempt + 1, attempt_start, response, "JSON_EXTRACTION_ERROR")
                     continue
 
                 try:
@@ -118,19 +436,21 @@ class OccPoSTagger:
                                        "Response is not a list",
                                        chunk_num=chunk_num,
                                        details=json_str)
+                        self._record_attempt(chunk_num, attempt + 1, attempt_start, response, "INVALID_JSON_STRUCTURE")
                         continue
 
-                    chunk_dict = {'word': [], 'upos': []}
-                    original_words = chunk.split()
-
-                    word_tag_map = {item['word']: item.get('upos', 'missing') 
-                                  for item in tagged_data if 'word' in item}
+                    codes = np.full(len(original_words), MISSING_CODE, dtype=np.uint8)
 
-                    for word in original_words:
-                        chunk_dict['word'].append(word)
-                        tag = word_tag_map.get(word, 'missing')
+                    if targets is None:
+                        position_tags = self.reconcile_tags(original_words, tagged_data)
+                    else:
+                        found = self.indexed_tags(original_words, tagged_data, positions)
+                        position_tags = [found.get(i) for i in positions]
 
-                        if word not in word_tag_map:
+                    for i, tag in zip(positions, position_tags):
+                        word = original_words[i]
+                        if tag is None:
+                            tag = 'missing'
                             self.log_problem("MISSING_TAG",
                                            "Word not found in model response",
                                            chunk_num=chunk_num,
@@ -142,29 +462,24 @@ class OccPoSTagger:
                                            chunk_num=chunk_num,
                                            word=word,
                                            details=f"Tag: {tag}")
-                            tag = 'missing'
+                        else:
+                            codes[i] = TAG_CODES[tag]
 
-                        chunk_dict['upos'].append(tag)
+                    self._print("\nChunk tags:")
+                    self._print("Words:", list(original_words))
+                    self._print("Tags:", decode_tags(codes).tolist())
 
-                    print("\nChunk dictionary:")
-                    print("Words:", chunk_dict['word'])
-                    print("Tags:", chunk_dict['upos'])
-
-                    if len(chunk_dict['word']) != len(original_words):
-                        self.log_problem("WORD_COUNT_MISMATCH",
-                                       "Word count mismatch between input and processed output",
-                                       chunk_num=chunk_num,
-                                       details=f"Expected: {len(original_words)}, Got: {len(chunk_dict['word'])}")
-
-                    cleaned_data = [{'word': w, 'upos': t} 
-                                  for w, t in zip(chunk_dict['word'], chunk_dict['upos'])]
-                    return cleaned_data, mismatched_words
+                    self._record_attempt(chunk_num, attempt + 1, attempt_start, response, "OK")
+                    self._record_chunk_stats(chunk_num, attempt + 1, time.time() - chunk_start, True, prompt_eval,
+                                             cached=attempt == 0 and bool(response.get('cached')))
+                    return codes, mismatched_words, responses
 
                 except json.JSONDecodeError as e:
                     self.log_problem("JSON_DECODE_ERROR",
                                    "Failed to decode JSON response",
                                    chunk_num=chunk_num,
                                    details=str(e))
+                    self._record_attempt(chunk_num, attempt + 1, attempt_start, response, "JSON_DECODE_ERROR")
                     continue
 
             except Exception as e:
@@ -172,14 +487,269 @@ class OccPoSTagger:
                                f"Error on attempt {attempt + 1}",
                                chunk_num=chunk_num,
                                details=str(e))
+                self._record_attempt(chunk_num, attempt + 1, attempt_start, response, "PROCESSING_ERROR")
                 if attempt < retries - 1:
-                    print(f"Retrying in {backoff} seconds...")
+                    self._print(f"Retrying in {backoff} seconds...")
                     time.sleep(backoff)
 
         self.log_problem("CHUNK_FAILURE",
                         "Failed to process chunk after all attempts",
                         chunk_num=chunk_num)
-        return None, mismatched_words
+        self._record_chunk_stats(chunk_num, retries, time.time() - chunk_start, False, prompt_eval)
+        return None, mismatched_words, responses
+
+    def _record_attempt(self, chunk_num, attempt, attempt_start, response, outcome):
+        """One row of the run metrics table: timings the server reported for one request."""
+        row = {
+            'chunk_number': chunk_num,
+            'attempt': attempt,
+            'outcome': outcome,
+            'cached': bool(response is not None and response.get('cached')),
+            'latency': time.time() - attempt_start,
+        }
+        for field in TELEMETRY_FIELDS:
+            row[field] = response.get(field) if response is not None else None
+        with self._lock:
+            self.attempt_stats.append(row)
+
+    def save_metrics(self, metrics_file, summary_file):
+        """
+        Write the per-attempt metrics table and a summary with
+        p50/p95/p99 of every timing (durations in seconds) plus the share of
+        the request time spent on model loading, prompt evaluation,
+        generation and failed attempts.
+        """
+        if not self.attempt_stats:
+            return
+        try:
+            df = pd.DataFrame(self.attempt_stats).sort_values(['chunk_number', 'attempt'])
+            for field in TELEMETRY_FIELDS:
+                df[field] = pd.to_numeric(df[field], errors='coerce')
+                if field.endswith('_duration'):
+                    df[field] = df[field] / 1e9
+            df['prompt_tokens_per_second'] = df['prompt_eval_count'] / df['prompt_eval_duration']
+            df['eval_tokens_per_second'] = df['eval_count'] / df['eval_duration']
+            df.to_csv(metrics_file, index=False)
+
+            attempts_per_chunk = df.groupby('chunk_number')['attempt'].max()
+            served = df[~df['cached']]
+            summary_columns = ['latency', *TELEMETRY_FIELDS, 'prompt_tokens_per_second', 'eval_tokens_per_second']
+            rows = []
+            for column, values in [*((c, served[c]) for c in summary_columns),
+                                   ('attempts_per_chunk', attempts_per_chunk),
+                                   ('retries_per_chunk', attempts_per_chunk - 1)]:
+                values = values.dropna()
+                rows.append({
+                    'metric': column,
+                    'count': len(values),
+                    'mean': values.mean(),
+                    'p50': values.quantile(0.50),
+                    'p95': values.quantile(0.95),
+                    'p99': values.quantile(0.99),
+                    'total': values.sum(),
+                })
+
+            total_latency = served['latency'].sum()
+            for column, seconds in [('share_load', served['load_duration'].sum()),
+                                    ('share_prompt_eval', served['prompt_eval_duration'].sum()),
+                                    ('share_generation', served['eval_duration'].sum()),
+                                    ('share_failed_attempts', served.loc[served['outcome'] != "OK", 'latency'].sum())]:
+                rows.append({'metric': column, 'total': seconds / total_latency if total_latency else 0.0})
+            pd.DataFrame(rows).to_csv(summary_file, index=False)
+            print(f"Run metrics saved to '{metrics_file}' and '{summary_file}'")
+
+        except Exception as e:
+            self.log_problem("METRICS_SAVE_ERROR", "Error saving run metrics", details=str(e))
+            print(f"Error saving run metrics: {str(e)}")
+
+    def _record_chunk_stats(self, chunk_num, attempts, latency, success, prompt_eval, cached=False):
+        with self._lock:
+            self.chunk_stats.append({
+                'chunk_number': chunk_num,
+                'attempts': attempts,
+                'latency': latency,
+                'success': success,
+                'cached': cached,  # served from the response cache without a request
+                'prompt_eval_count': prompt_eval['count'],
+                'prompt_eval_duration': prompt_eval['duration'],  # nanoseconds
+            })
+
+    def run_summary(self):
+        """
+        Retry rate and chunk latency of the chunks tagged so far, without the
+        chunks served from the response cache (counted in cached_chunks).
+        """
+        served = [s for s in self.chunk_stats if not s['cached']]
+        chunks = len(served)
+        attempts = sum(s['attempts'] for s in served)
+        return {
+            'output_mode': "structured" if self.structured_output else "free-form",
+            'chunks': chunks,
+            'cached_chunks': len(self.chunk_stats) - chunks,
+            'attempts': attempts,
+            'retry_rate': (attempts - chunks) / chunks if chunks else 0.0,
+            'failed_chunks': sum(not s['success'] for s in served),
+            'mean_chunk_latency': sum(s['latency'] for s in served) / chunks if chunks else 0.0,
+            'prefix_mode': self.prefix_mode,
+            'prompt_eval_count': sum(s['prompt_eval_count'] for s in served),
+            'prompt_eval_seconds': sum(s['prompt_eval_duration'] for s in served) / 1e9,
+        }
+
+    def output_schema(self, num_words, indexed=False):
+        """
+        JSON schema for the structured output mode: an array with one
+        {"word", "upos"} object per input word, upos restricted to self.ud_tags.
+        indexed: {"index", "word", "upos"} objects, for targeted chunks.
+        """
+        properties = {
+            "word": {"type": "string"},
+            "upos": {"type": "string", "enum": sorted(self.ud_tags)},
+        }
+        if indexed:
+            properties = {"index": {"type": "integer"}, **properties}
+        return {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": properties,
+                "required": list(properties),
+            },
+            "minItems": num_words,
+            "maxItems": num_words,
+        }
+
+    def _generate(self, chunk, use_cache=True, prompt=None, num_targets=None):
+        """
+        Send one chunk to the model. Responses are served from and stored in
+        self.cache when it is set; retries bypass the cached entry. A custom
+        prompt (e.g. for repair requests) is always sent without streaming
+        or prefix reuse; it only gets an output schema for a targeted
+        chunk (num_targets answer items).
+        """
+        tagging_request = prompt is None
+        prompt = self.prompt if prompt is None else prompt
+        options = {"num_ctx": self.ctx}
+        output_format = None
+        if tagging_request and self.structured_output:
+            output_format = self.output_schema(len(chunk.split()))
+        elif num_targets is not None and self.structured_output:
+            output_format = self.output_schema(num_targets, indexed=True)
+        key = None
+        if self.cache is not None:
+            key_options = dict(options, format=output_format) if output_format else options
+            if tagging_request and self.prefix_mode is not None:
+                key_options = dict(key_options, prefix_mode=self.prefix_mode)
+            key = self.cache.make_key(self.model_name, prompt, chunk, key_options)
+            if use_cache:
+                cached = self.cache.get(key)
+                if cached is not None:
+                    cached['cached'] = True
+                    return cached
+
+        if tagging_request and self.stream:
+            response = self._generate_stream(chunk, options, output_format)
+            if response['done_reason'] is None or response['done_reason'] == "diverged":
+                # cut off before a complete answer, not worth serving again
+                return response
+        else:
+            response = self._backend().generate(model=self.model_name,
+                                                **self._prompt_args(prompt, chunk, tagging_request),
+                                                format=output_format,
+                                                options=options,
+                                                keep_alive=self.keep_alive)
+
+        if self.cache is not None:
+            self.cache.put(key, {field: response.get(field) for field in RESPONSE_FIELDS})
+        return response
+
+    def _prompt_args(self, prompt, chunk, tagging_request=True):
+        """
+        Prompt arguments of a request. With prefix_mode "system" the
+        instructions are sent as a byte-identical system prompt, with
+        "context" the chunk continues the token context returned for the
+        instructions alone. Either way every chunk shares the same prefix, so
+        the server can reuse its cached evaluation of it.
+        """
+        if not tagging_request or self.prefix_mode is None:
+            return {'prompt': prompt + "\n" + chunk}
+        if self.prefix_mode == "system":
+            return {'system': self.prefix_prompt(), 'prompt': chunk}
+        if self.prefix_mode == "context":
+            return {'context': self._prefix_context(), 'prompt': chunk}
+        raise ValueError(f"Unknown prefix_mode '{self.prefix_mode}'")
+
+    def target_prompt(self):
+        """The prompt of targeted chunks: self.prompt followed by self.target_instructions."""
+        return self.prompt + "\n" + self.target_instructions
+
+    def prefix_prompt(self):
+        """The instructions as sent with prefix_mode: without the indentation of the source code."""
+        return "\n".join(line.strip() for line in self.prompt.strip().splitlines())
+
+    def _prefix_context(self):
+        with self._prefix_lock:
+            prefix = self.prefix_prompt()
+            key = (self.model_name, prefix)
+            if key not in self._prefix_contexts:
+                # the server returns the context after generating at least one token,
+                # the generated tokens are cut off so the chunk follows the instructions directly
+                response = self._backend().generate(model=self.model_name,
+                                                    prompt=prefix,
+                                                    options={"num_ctx": self.ctx, "num_predict": 1},
+                                                    keep_alive=self.keep_alive)
+                context = list(response['context'])
+                generated = response.get('eval_count') or 0
+                self._prefix_contexts[key] = context[:len(context) - generated]
+            return self._prefix_contexts[key]
+
+    def _backend(self):
+        # the ollama module talks to the default host, a BackendPool spreads requests over several
+        return self.backend if self.backend is not None else ollama
+
+    def _generate_stream(self, chunk, options, output_format=None, drain_parts=20):
+        """
+        Stream the response and parse it while it arrives. Generation is cut
+        off as soon as the output diverges from the chunk; closing the stream
+        stops the request on the server side, and the objects parsed until
+        then are returned as the answer. Once every word of the chunk is
+        tagged, up to drain_parts more parts are read for the closing "done"
+        part and its telemetry, then the stream is closed. The telemetry of a
+        cut-off stream is what the last part received carried.
+        """
+        parser = StreamingTagParser(chunk.split())
+        stream = self._backend().generate(model=self.model_name,
+                                          **self._prompt_args(self.prompt, chunk),
+                                          format=output_format,
+                                          options=options,
+                                          keep_alive=self.keep_alive,
+                                          stream=True)
+        response = {'response': "", 'done_reason': None}
+        drained = 0
+        try:
+            for part in stream:
+                if response['done_reason'] == "complete":
+                    drained += 1
+                else:
+                    status = parser.feed(part['response'])
+                response.update({field: part.get(field) for field in RESPONSE_FIELDS
+                                 if field != 'response' and part.get(field) is not None})
+                if part.get('done'):
+                    response['done_reason'] = response['done_reason'] or part.get('done_reason') or "stop"
+                    break
+                if status == "diverged":
+                    response['done_reason'] = status
+                    break
+                if status == "complete":
+                    response['done_reason'] = status
+                    if drained >= drain_parts:
+                        break
+        finally:
+            close = getattr(stream, 'close', None)
+            if close is not None:
+                close()
+
+        response['response'] = parser.result_text() if parser.status in ("complete", "diverged") else parser.text
+        return response
 
     def _extract_json(self, response_content):
         try:
@@ -201,30 +771,48 @@ class OccPoSTagger:
                            details=str(e))
             return None
 
-    def create_output_dictionary(self, processed_chunks, original_words):
-        output_dict = {
-            'word': [],
-            'upos': []
-        }
-        
+    def reconcile_tags(self, original_words, tagged_data):
+        """
+        Match the model output to the input positions and return one tag per
+        input word (None where the model gave no tag). Output words are
+        compared on normalize_word keys, so differences in case, diacritics
+        and surrounding punctuation still match, and matched in order along
+        a longest common subsequence: words the model dropped, added or
+        changed leave gaps, and a repeated word ("e", "de") keeps the tag of
+        its own occurrence.
+        """
+        items = [item for item in tagged_data if isinstance(item, dict) and 'word' in item]
+        keys = [normalize_word(word) for word in original_words]
+        output_keys = [normalize_word(item['word']) for item in items]
+        tags = [None] * len(keys)
+        for i, j in common_subsequence(keys, output_keys):
+            tags[i] = items[j].get('upos', 'missing')
+        return tags
+
+    def valid_codes(self):
+        """Tag codes of self.ud_tags."""
+        return np.array(sorted(TAG_CODES[tag] for tag in self.ud_tags), dtype=np.uint8)
+
+    def validate_output(self, chunk):
+        """
+        Log the words of a chunk view (or of corpus.view()) without a tag of
+        self.ud_tags before they are written, and store those as MISSING_CODE.
+        """
+        tags = chunk.tags
+        invalid = np.flatnonzero(~np.isin(tags, self.valid_codes()))
+        for i, tag in zip(invalid, decode_tags(tags[invalid])):
+            self.log_problem("INVALID_TAG_IN_OUTPUT",
+                             "Invalid tag in final output",
+                             word=chunk.words[i],
+                             details=f"Tag: {tag}")
+        tags[invalid] = MISSING_CODE
+
+    def create_output_dictionary(self, corpus):
+        """Validated word and tag lists of the whole TaggedCorpus."""
         try:
-            word_tag_map = {}
-            for chunk_data in processed_chunks:
-                if chunk_data:
-                    for item in chunk_data:
-                        word_tag_map[item['word']] = item['upos']
-
-            for word in original_words:
-                output_dict['word'].append(word)
-                tag = word_tag_map.get(word, 'missing')
-                if tag not in self.ud_tags:
-                    self.log_problem("INVALID_TAG_IN_OUTPUT",
-                                   "Invalid tag in final output",
-                                   word=word,
-                                   details=f"Tag: {tag}")
-                    tag = 'missing'
-                output_dict['upos'].append(tag)
-            print(output_dict)
+            self.validate_output(corpus.view())
+            output_dict = {'word': corpus.words.tolist(), 'upos': corpus.tag_strings().tolist()}
+            self._print(output_dict)
             return output_dict
         except Exception as e:
             self.log_problem("OUTPUT_CREATION_ERROR",
@@ -232,9 +820,123 @@ class OccPoSTagger:
                            details=str(e))
             raise
 
-    def save_to_excel(self, output_dict, output_file):
+    def load_tagged_excel(self, tagged_file):
+        df = pd.read_excel(tagged_file, keep_default_na=False)
+        return TaggedCorpus(df['word'].astype(str).to_numpy(dtype=object), tags=df['upos'].astype(str))
+
+    def repair_missing(self, corpus, log_file=None, context=8, max_targets=15, retries=3):
+        """
+        Re-query only the positions of the TaggedCorpus without a valid UD tag.
+        Neighbouring positions are grouped into windows of at most max_targets
+        targets; every request shows the window with `context` words on each
+        side as a numbered list and asks for the target positions only.
+        Windows are sent like chunks, up to num_parallel at a time, and none
+        are started after request_stop(); their responses go to the run log
+        (or to log_file without one). The tags of the corpus are updated in
+        place and the corpus returned.
+        """
+        words, tags = corpus.words, corpus.tags
+        valid_codes = self.valid_codes()
+        targets = np.flatnonzero(~np.isin(tags, valid_codes)).tolist()
+        if not targets:
+            return corpus
+
+        groups = []
+        for position in targets:
+            if groups and len(groups[-1]) < max_targets and position - groups[-1][-1] <= context:
+                groups[-1].append(position)
+            else:
+                groups.append([position])
+        print(f"Repairing {len(targets)} untagged words in {len(groups)} requests")
+
+        repaired = 0
+        with ThreadPoolExecutor(max_workers=max(1, self.num_parallel)) as executor:
+            results = executor.map(lambda group: self._repair_group(words, group, context, retries), groups)
+            for group_num, (group_tags, responses) in enumerate(results, 1):
+                self.write_repairs(log_file, group_num, len(groups), responses)
+                for request, response_content in responses:
+                    self._print(f"\nRepair {group_num}/{len(groups)}")
+                    self._print("Response model: ", response_content)
+                for position, tag in group_tags.items():
+                    tags[position] = TAG_CODES[tag]
+                repaired += len(group_tags)
+                if self.run_log is not None:
+                    self.run_log.progress(group_num, len(groups), unit="Repairs")
+
+        for position in targets:
+            if tags[position] not in valid_codes:
+                self.log_problem("REPAIR_FAILURE", "Word still untagged after repair",
+                                 word=words[position], details=f"Position: {position + 1}")
+        print(f"Repaired {repaired} of {len(targets)} untagged words")
+        return corpus
+
+    def _repair_group(self, words, group, context, retries):
+        """Query one window of repair targets; returns ({position: tag}, [(request, response)])."""
+        found = {}
+        responses = []
+        for attempt in range(retries):
+            if self.stop_requested:
+                break
+            start = max(0, group[0] - context)
+            end = min(len(words), group[-1] + context + 1)
+            request = self.indexed_request(words, start, end, group)
+            try:
+                response_content = self._generate(request, use_cache=attempt == 0, prompt=self.repair_prompt)['response']
+            except Exception as e:
+                self.log_problem("REPAIR_ERROR", f"Error on repair attempt {attempt + 1}",
+                                 details=str(e))
+                continue
+            responses.append((request, response_content))
+
+            json_str = self._extract_json(response_content)
+            try:
+                tagged_data = json.loads(json_str) if json_str else None
+            except json.JSONDecodeError:
+                tagged_data = None
+            if not isinstance(tagged_data, list):
+                self.log_problem("REPAIR_JSON_ERROR", "Could not read repair response",
+                                 details=response_content)
+                continue
+
+            pending = set(group)
+            for position, tag in self.indexed_tags(words, tagged_data, group).items():
+                if tag in self.ud_tags:
+                    found[position] = tag
+                    pending.discard(position)
+            if not pending:
+                break
+            group = sorted(pending)
+        return found, responses
+
+    @staticmethod
+    def indexed_request(words, start, end, positions):
+        """Words start..end as a numbered list (numbered like words, from 1) and the positions to tag."""
+        request = "Words:\n" + "\n".join(f"{i + 1}. {words[i]}" for i in range(start, end))
+        return request + "\nPositions to tag: " + ", ".join(str(i + 1) for i in positions)
+
+    @staticmethod
+    def indexed_tags(words, tagged_data, positions):
+        """
+        {position: upos} of the answer to an indexed_request: items whose
+        index is one of positions and whose word is the word at that index.
+        """
+        found = {}
+        positions = set(positions)
+        for item in tagged_data:
+            if not isinstance(item, dict):
+                continue
+            try:
+                position = int(item.get('index')) - 1
+            except (TypeError, ValueError):
+                continue
+            word = str(item.get('word', '')).strip().casefold()
+            if position in positions and position not in found and word == words[position].casefold():
+                found[position] = item.get('upos', 'missing')
+        return found
+
+    def save_to_excel(self, corpus, output_file):
         try:
-            df = pd.DataFrame(output_dict)
+            df = pd.DataFrame({'word': corpus.words, 'upos': corpus.tag_strings()})
             df.to_excel(output_file, index=False)
             print(f"Results successfully saved to '{output_file}'")
 
@@ -251,37 +953,141 @@ def sanitize_filename(filename):
     """
     return re.sub(r':', '_', filename)
 
-def main():
-    start_time = time.time()
+def repair_tagged_file(tagger, tagged_file, log_file=None, problems_file=None):
+    """
+    Fill the missing tags of an existing *_tagged_*.xlsx file in place. The
+    problems of the repair are written to problems_file (default: next to
+    the tagged file, ending in _repair_problems_log.txt).
+    """
+    tagger.reset_run_state()  # the run log of an earlier run is closed, responses go to log_file
+    path = Path(tagged_file)
+    problems_file = problems_file or str(path.with_name(f"{path.stem}_repair_problems_log.txt"))
+    corpus = tagger.load_tagged_excel(tagged_file)
+    tagger.repair_missing(corpus, log_file=log_file)
+    tagger.save_to_excel(corpus, tagged_file)
+    tagger.save_problems_log(problems_file)
+    print(f"Problems log saved to '{problems_file}'")
 
-    tagger = OccPoSTagger()
+def output_file_name(input_file, model_name, prompt_name):
+    return sanitize_filename(f"{Path(input_file).stem}_tagged_{model_name}_{prompt_name}.xlsx")
+
+def run_prompt_name(tagger, prompt_name):
+    """prompt_name with the suffixes of the tagger's output mode, as used in the names of the run files."""
+    if tagger.structured_output:
+        prompt_name = f"{prompt_name}_structured"
+    if tagger.lexicon is not None:
+        prompt_name = f"{prompt_name}_lexicon"
+        if tagger.variants:
+            prompt_name = f"{prompt_name}_variants"
+    return prompt_name
+
+def run_tagging(tagger, input_file, prompt_name="prompt2"):
+    """
+    Tag one text with the tagger's current model and prompt and write the
+    per-run files (*_tagged_*.xlsx, responses, problems log, ...) named
+    after the text, model and prompt_name.
+    """
+    start_time = time.time()
+    tagger.reset_run_state()
     
     model_name = tagger.model_name
     
-    # Input and output file paths
-    input_file = "./Albuc1.txt" # text: Albuc1.txt or NAF6195.txt
     path = Path(input_file)
+    free_form_prompt_name = prompt_name
+    prompt_name = run_prompt_name(tagger, prompt_name)
          
-    output_file = sanitize_filename(f"{path.stem}_tagged_{model_name}_prompt2.xlsx")
-    log_file = sanitize_filename(f"{path.stem}_responses_{model_name}_prompt2.txt")
-    problems_file = sanitize_filename(f"{path.stem}_problems_log_{model_name}_prompt2.txt")
-    mismatched_words_file = sanitize_filename(f"{path.stem}_mismatched_words_{model_name}_prompt2.txt")
-    elapsed_time_file = sanitize_filename(f"{path.stem}_elapsed_time_{model_name}_prompt2.txt")
+    output_file = output_file_name(input_file, model_name, prompt_name)
+    log_file = sanitize_filename(f"{path.stem}_responses_{model_name}_{prompt_name}.txt")
+    problems_file = sanitize_filename(f"{path.stem}_problems_log_{model_name}_{prompt_name}.txt")
+    problems_jsonl_file = sanitize_filename(f"{path.stem}_problems_log_{model_name}_{prompt_name}.jsonl")
+    mismatched_words_file = sanitize_filename(f"{path.stem}_mismatched_words_{model_name}_{prompt_name}.txt")
+    elapsed_time_file = sanitize_filename(f"{path.stem}_elapsed_time_{model_name}_{prompt_name}.txt")
+    checkpoint_file = sanitize_filename(f"{path.stem}_checkpoint_{model_name}_{prompt_name}.jsonl")
+    run_stats_file = sanitize_filename(f"{path.stem}_run_stats_{model_name}_{prompt_name}.json")
+    metrics_file = sanitize_filename(f"{path.stem}_metrics_{model_name}_{prompt_name}.csv")
+    metrics_summary_file = sanitize_filename(f"{path.stem}_metrics_summary_{model_name}_{prompt_name}.csv")
+    repair_log_file = sanitize_filename(f"{path.stem}_repair_responses_{model_name}_{prompt_name}.txt")
+    free_form_stats_file = sanitize_filename(f"{path.stem}_run_stats_{model_name}_{free_form_prompt_name}.json")
     
-    # Read input text
-    text = tagger.read_text_file(input_file)
+    # Read input text; its corpus index gives the words, sentence boundaries and the content hash
+    index = tagger.read_text_index(input_file)
+    corpus = TaggedCorpus.from_index(index)
+    tagger.run_log = RunLogger(problems_jsonl_file, log_file, quiet=tagger.quiet, repairs_file=repair_log_file)
+
+    # Forms the lexicon knows with confidence are tagged without the model;
+    # the text itself is left out of the lexicon, its reference is what the output is evaluated against
+    pretagged = np.zeros(len(corpus), dtype=bool)
+    if tagger.lexicon is not None:
+        variants = None
+        if tagger.variants:
+            variants = tagger.lexicon.variant_index(exclude_texts=[path.stem], forms=corpus.words)
+            print(f"Variant index: {len(variants.form_clusters)} forms in {len(variants.clusters)} clusters")
+        pretagged = tagger.lexicon.pretag(corpus, exclude_texts=[path.stem], allowed_tags=tagger.ud_tags,
+                                          variants=variants)
+        print(f"Lexicon: {pretagged.sum()} of {len(corpus)} words tagged without the model")
+
+    # the model only tags the words the lexicon does not know, the other words of a chunk are context
+    keep = pretagged if tagger.lexicon is not None else None
+    targets = None if keep is None else ~keep
 
-    # Step 1: Build chunks
-    chunks, original_words = tagger.build_chunks(text, chunk_size=50)
+    output_base = output_file[:-len(".xlsx")]
+    sentence_lengths = corpus.nonempty_sentence_lengths()
+    # Step 1: Build chunks of whole sentences (tagger.build_chunks(corpus, chunk_size=50) gives the old fixed chunks)
+    chunks = tagger.build_sentence_chunks(corpus, targets=targets)
+    chunk_stats = tagger.chunk_statistics(chunks, targets=targets)
     print(f"Created {len(chunks)} chunks from input text")
+    print(f"Words per chunk: {chunk_stats['min_words']}-{chunk_stats['max_words']} (mean {chunk_stats['mean_words']:.1f}), "
+          f"estimated tokens per request: mean {chunk_stats['mean_tokens']:.0f}, max {chunk_stats['max_tokens']}, "
+          f"{chunk_stats['instruction_tokens']} of {chunk_stats['total_tokens']} spent on the repeated prompt")
+    if keep is not None:
+        skipped = sum(bool(keep[chunk.start:chunk.end].all()) for chunk in chunks)
+        print(f"Lexicon: {targets.sum()} words sent to the model, {skipped} chunks need no request")
 
-    # Step 2: Process chunks
-    processed_chunks = []
+    # Resume from an earlier, interrupted run with the same configuration
+    run_config = {
+        'model': model_name,
+        'prompt': tagger.prompt if keep is None else tagger.target_prompt(),
+        'num_ctx': tagger.ctx,
+        'structured_output': tagger.structured_output,
+        'prefix_mode': tagger.prefix_mode,
+        'chunk_token_budget': tagger.chunk_token_budget,
+        'text_sha256': index.sha256,
+    }
+    tagger.checkpoint = ChunkCheckpoint(checkpoint_file, run_config)
+    if tagger.checkpoint.completed:
+        print(f"Resuming: {len(tagger.checkpoint.completed)} chunks already done in '{checkpoint_file}'")
+    signal.signal(signal.SIGINT, tagger.request_stop)
+
+    # Output files are written while the chunks come in, unless the repair
+    # pass still has to change tags at the end
+    outputs = [] if tagger.repair_missing_tags else open_outputs(tagger.output_formats, output_base, sentence_lengths)
+
+    # Step 2: Process chunks, their tags are written into the corpus
+    processed_chunks = 0
     mismatched_words = []  # List to collect mismatched words
-    for i, chunk in enumerate(chunks, 1):
-        chunk_result, chunk_mismatched_words = tagger.process_chunk(chunk, i, len(chunks), log_file)
-        processed_chunks.append(chunk_result)
-        mismatched_words.extend(chunk_mismatched_words)
+    try:
+        for chunk, chunk_mismatched_words in tagger.process_chunks(chunks, log_file, keep=keep):
+            processed_chunks += 1
+            mismatched_words.extend(chunk_mismatched_words)
+            if outputs:
+                tagger.validate_output(chunk)
+            for output in outputs:
+                output.write(chunk)
+    except BaseException:
+        for output in outputs:
+            output.abort()
+        raise
+    finally:
+        tagger.checkpoint.close()
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    if tagger.stop_requested:
+        for output in outputs:
+            output.abort()
+        tagger.save_problems_log(problems_file)
+        print(f"Stopped after {processed_chunks}/{len(chunks)} chunks. "
+              f"Run again to resume from '{checkpoint_file}'.")
+        sys.exit(130)
 
     # Save mismatched words (original + output) to a file
     if mismatched_words:
@@ -290,14 +1096,43 @@ def main():
                 f.write(f"{original_word}\t{output_word}\n")  # Tab-separated for easy reading
         print(f"Mismatched words saved to '{mismatched_words_file}'")
 
-    # Steps 3 & 4: Create and validate output dictionary
-    output_dict = tagger.create_output_dictionary(processed_chunks, original_words)
+    # Steps 3 & 4: Validate the tags, then re-query only the words that are still untagged
+    if tagger.repair_missing_tags:
+        tagger.validate_output(corpus.view())
+        tagger.repair_missing(corpus, log_file=repair_log_file)
+        outputs = open_outputs(tagger.output_formats, output_base, sentence_lengths)
+        for output in outputs:
+            output.write(corpus.view())
+
+    # Step 5: Save the output files
+    try:
+        for output in outputs:
+            output.close()
+            print(f"Results successfully saved to '{output.output_file}'")
+    except Exception as e:
+        tagger.log_problem("FILE_SAVE_ERROR",
+                   "Error saving files",
+                   details=str(e))
+        print(f"Error saving files: {str(e)}")
+        sys.exit(1)
 
-    # Step 5: Save to Excel
-    tagger.save_to_excel(output_dict, output_file)
+    # The words the model tagged in this run become a new source of the lexicon
+    if tagger.lexicon is not None:
+        model_tagged = ~pretagged
+        tagger.lexicon.add_counts(Path(output_file).stem, corpus.words[model_tagged],
+                                  corpus.tag_strings()[model_tagged], text=path.stem, file=output_file)
     
-    # Save problems log
+    # Save per-request metrics and problems log
+    tagger.save_metrics(metrics_file, metrics_summary_file)
     tagger.save_problems_log(problems_file)
+
+    if tagger.cache is not None:
+        stats = tagger.cache.stats()
+        print(f"Response cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.1%} hit rate)")
+    if tagger.backend is not None:
+        for endpoint in tagger.backend.stats():
+            print(f"Endpoint {endpoint['host']}: {endpoint['requests']} requests, {endpoint['failures']} failures"
+                  f"{'' if endpoint['healthy'] else ' (unhealthy)'}")
     
     total_time = time.time() - start_time
     print(f"\nTotal processing time: {total_time:.2f} seconds")
@@ -306,5 +1141,37 @@ def main():
     with open(elapsed_time_file, 'w', encoding='utf-8') as f:
         f.write(f"Total processing time for model '{model_name}' and text '{path.stem}': {total_time:.2f} seconds\n")
 
+    # Retry rate and chunk latency, compared with the free-form run of the same model and text if there is one
+    summary = tagger.run_summary()
+    with open(run_stats_file, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+    print(f"Output mode: {summary['output_mode']}, retry rate: {summary['retry_rate']:.3f}, "
+          f"mean chunk latency: {summary['mean_chunk_latency']:.2f} seconds "
+          f"({summary['chunks']} chunks requested, {summary['cached_chunks']} served from the cache)")
+    print(f"Prompt evaluation ({summary['prefix_mode'] or 'no prefix reuse'}): {summary['prompt_eval_count']} tokens "
+          f"in {summary['prompt_eval_seconds']:.2f} seconds")
+    if tagger.structured_output and Path(free_form_stats_file).exists():
+        with open(free_form_stats_file, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"Compared with free-form prompting: retry rate {baseline['retry_rate']:.3f} -> {summary['retry_rate']:.3f}, "
+              f"mean chunk latency {baseline['mean_chunk_latency']:.2f} -> {summary['mean_chunk_latency']:.2f} seconds")
+
+    return output_file
+
+def main():
+    tagger = OccPoSTagger()
+    tagger.cache = ResponseCache(".response_cache")  # reruns with the same model, prompt and chunks are served from disk
+    # To spread chunks over several inference servers (from backends import BackendPool):
+    # tagger.backend = BackendPool(["http://localhost:11434", "http://gpu2:11434"])
+    # tagger.num_parallel = 8
+    # To tag the forms known with confidence without the model
+    # (build the lexicon first with lexicon.py; from lexicon import Lexicon):
+    # tagger.lexicon = Lexicon(".lexicon")
+    # tagger.variants = True  # also tag rare spellings from their variant cluster
+
+    # Input file path, outputs are written to the current directory
+    input_file = "./Albuc1.txt" # text: Albuc1.txt or NAF6195.txt
+    run_tagging(tagger, input_file, prompt_name="prompt2")
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Output writers for tagger results. All of them take the tagged tokens in
+corpus order through write(chunk), one chunk view of the TaggedCorpus at a
+time, and keep the word/upos schema of the Excel output. close() finishes
+the file, abort() drops an unfinished one.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from tagged_corpus import decode_tags
+
+
+class ExcelOutput:
+    """
+    The *_tagged_*.xlsx file; Excel cannot be appended to, so the chunk views
+    are kept and the file is written on close().
+    """
+
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self.chunks = []
+
+    def write(self, chunk):
+        self.chunks.append(chunk)
+
+    def close(self):
+        words, tags = _concatenate(self.chunks)
+        pd.DataFrame({'word': words, 'upos': decode_tags(tags)}).to_excel(self.output_file, index=False)
+
+    def abort(self):
+        pass
+
+
+class ParquetOutput:
+    """Parquet file with string columns word and upos, written in row groups."""
+
+    def __init__(self, output_file, row_group_size=10000):
+        self.output_file = output_file
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Parquet output needs pyarrow (pip install pyarrow)")
+        self._pa = pa
+        self.schema = pa.schema([('word', pa.string()), ('upos', pa.string())])
+        self.writer = pq.ParquetWriter(output_file, self.schema)
+        self.row_group_size = row_group_size
+        self.chunks = []
+        self.pending = 0
+
+    def write(self, chunk):
+        self.chunks.append(chunk)
+        self.pending += len(chunk)
+        if self.pending >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if self.pending:
+            words, tags = _concatenate(self.chunks)
+            table = self._pa.Table.from_pydict({'word': words, 'upos': decode_tags(tags)}, schema=self.schema)
+            self.writer.write_table(table)
+            self.chunks, self.pending = [], 0
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+
+    def abort(self):
+        # an unfinished run must not leave a file that looks like a finished one
+        self.writer.close()
+        os.remove(self.output_file)
+
+
+class ConlluOutput:
+    """
+    CoNLL-U file with one sentence per line of the input text (as given by
+    sentence_lengths). Only ID, FORM and UPOS are filled; untagged words get
+    '_' as UPOS. Complete sentences are written as soon as their last word
+    arrives.
+    """
+
+    def __init__(self, output_file, sentence_lengths):
+        self.output_file = output_file
+        self.f = open(output_file, 'w', encoding='utf-8')
+        self.sentence_lengths = iter(sentence_lengths)
+        self.sent_id = 0
+        self.pending_words = []
+        self.pending_tags = []
+        self.next_length = next(self.sentence_lengths, None)
+
+    def write(self, chunk):
+        self.pending_words.extend(chunk.words)
+        self.pending_tags.extend(chunk.tag_strings())
+        while self.next_length is not None and len(self.pending_words) >= self.next_length:
+            n = self.next_length
+            self._write_sentence(self.pending_words[:n], self.pending_tags[:n])
+            del self.pending_words[:n], self.pending_tags[:n]
+            self.next_length = next(self.sentence_lengths, None)
+
+    def _write_sentence(self, words, tags):
+        self.sent_id += 1
+        self.f.write(f"# sent_id = {self.sent_id}\n")
+        self.f.write(f"# text = {' '.join(words)}\n")
+        for i, (word, tag) in enumerate(zip(words, tags), 1):
+            upos = tag if tag != 'missing' else '_'
+            self.f.write(f"{i}\t{word}\t_\t{upos}\t_\t_\t_\t_\t_\t_\n")
+        self.f.write("\n")
+
+    def close(self):
+        if self.pending_words:
+            self._write_sentence(self.pending_words, self.pending_tags)
+        self.f.close()
+
+    def abort(self):
+        self.f.close()
+        os.remove(self.output_file)
+
+
+def _concatenate(chunks):
+    """Words and tag codes of consecutive chunk views."""
+    if not chunks:
+        return np.array([], dtype=object), np.array([], dtype=np.uint8)
+    return np.concatenate([c.words for c in chunks]), np.concatenate([c.tags for c in chunks])
+
+
+def open_outputs(formats, base_name, sentence_lengths=None):
+    """Writers for the requested formats ("xlsx", "parquet", "conllu"), files named base_name + extension."""
+    outputs = []
+    for output_format in formats:
+        if output_format == "xlsx":
+            outputs.append(ExcelOutput(f"{base_name}.xlsx"))
+        elif output_format == "parquet":
+            outputs.append(ParquetOutput(f"{base_name}.parquet"))
+        elif output_format == "conllu":
+            outputs.append(ConlluOutput(f"{base_name}.conllu", sentence_lengths if sentence_lengths is not None else []))
+        else:
+            raise ValueError(f"Unknown output format '{output_format}'")
+    return outputs
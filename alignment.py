@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Alignment of the words emitted by a model (the *_responses_*.txt logs of the
+tagger) with the tokens of the tagged text, written in the format of the
+alignment_*.xlsx files of alignment-rs (Reference Word, Matched Word,
+Similarity).
+
+Every chunk of the log is aligned with its own slice of the text, found from
+the input texts of the chunks in order. "--- Repair i/n ---" sections (in the
+log itself or in the *_repair_responses_* log) name the text positions they
+tag, so their words fill the tokens the chunks left unmatched. Within a chunk the alignment keeps
+the word order: a dynamic program over reference x emitted words that only
+fills the cells within `band` positions of the diagonal of the chunk, so a
+word never matches a token far away and a whole corpus aligns in time linear
+in its length. When a chunk was tried several times, its last response is
+used. Words are compared with similarity.SimilarityScorer, one batch of
+band cells per reference word; pass the same scorer to every log of a run so
+the word pairs they share are scored once.
+"""
+import json
+import os
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+from corpus_index import load_index
+from similarity import SimilarityScorer
+
+MISSING_WORD = "<<MISSING>>"
+
+SECTION_HEADER_RE = re.compile(r"^--- (.+) ---$", re.MULTILINE)
+SECTION_RE = re.compile(r"--- (\w+) (\d+)/(\d+) ---\nInput text: (.*?)\nResponse:\n", re.DOTALL)
+WORD_UPOS_RE = re.compile(r'"word":\s*"((?:[^"\\]|\\.)*)",\s*"upos":\s*"((?:[^"\\]|\\.)*)"')
+INDEX_WORD_RE = re.compile(r'"index":\s*"?(\d+)"?,\s*"word":\s*"((?:[^"\\]|\\.)*)"')
+
+# back pointers of the dynamic program
+SKIP_REFERENCE, SKIP_EMITTED, MATCH = 1, 2, 3
+
+
+def read_sections(log_file):
+    """
+    (kind, number, input text, response) of every section of a responses
+    log in the "--- Chunk i/n ---" text format, kind being "Chunk" or
+    "Repair"; a section ends at the next "--- ... ---" header of any kind.
+    Logs in JSON lines only hold chunks.
+    """
+    with open(log_file, 'r', encoding='utf-8') as f:
+        content = f.read()
+    sections = []
+    if log_file.endswith(".jsonl"):
+        for line in content.splitlines():
+            if line.strip():
+                entry = json.loads(line)
+                sections.append(("Chunk", entry['chunk_number'], entry['input'], entry['response']))
+        return sections
+
+    headers = [header.start() for header in SECTION_HEADER_RE.finditer(content)] + [len(content)]
+    for start, end in zip(headers, headers[1:]):
+        section = SECTION_RE.match(content, start, end)
+        if section is None:
+            continue
+        sections.append((section.group(1), int(section.group(2)), section.group(4), content[section.end():end]))
+    return sections
+
+
+def read_responses(log_file):
+    """
+    {chunk number: (input text, last response)} of a responses log, in the
+    "--- Chunk i/n ---" text format or as JSON lines. Repair sections are
+    left out, see read_repairs.
+    """
+    return {number: (input_text, response)
+            for kind, number, input_text, response in read_sections(log_file) if kind == "Chunk"}
+
+
+def read_repairs(log_file):
+    """{text position (0-based): word} of the repair responses of a log, later attempts win."""
+    words = {}
+    for kind, number, input_text, response in read_sections(log_file):
+        if kind != "Repair":
+            continue
+        for match in INDEX_WORD_RE.finditer(response):
+            try:
+                word = json.loads(f'"{match.group(2)}"')
+            except json.JSONDecodeError:
+                word = match.group(2)
+            words[int(match.group(1)) - 1] = word
+    return words
+
+
+def extract_words(response):
+    """Words of the word/upos pairs of a response, also from JSON that is cut short."""
+    words = []
+    for match in WORD_UPOS_RE.finditer(response):
+        try:
+            words.append(json.loads(f'"{match.group(1)}"'))
+        except json.JSONDecodeError:
+            words.append(match.group(1))
+    return words
+
+
+def chunk_offsets(chunks, reference_words):
+    """
+    Start position in the text of every chunk (in chunk order), from the word
+    counts of the input texts. A chunk number missing from the log shifts all
+    later chunks, so the inputs are checked against the text.
+    """
+    offsets = {}
+    position = 0
+    for chunk_num in sorted(chunks):
+        input_words = chunks[chunk_num][0].split()
+        if list(reference_words[position:position + len(input_words)]) != input_words:
+            print(f"Warning: input of chunk {chunk_num} does not match the text at position {position}")
+        offsets[chunk_num] = position
+        position += len(input_words)
+    if position != len(reference_words):
+        print(f"Warning: the chunks cover {position} of {len(reference_words)} words of the text")
+    return offsets
+
+
+def align_chunk(reference, emitted, band=10, threshold=0.5, scorer=None):
+    """
+    Order-preserving alignment of two word lists with the highest total
+    similarity; only pairs with similarity >= threshold can match, and
+    reference word i only meets emitted words within band of i * m / n.
+    Returns (matched emitted position or -1, similarity) for every reference word.
+    """
+    scorer = scorer if scorer is not None else SimilarityScorer()
+    n, m = len(reference), len(emitted)
+    matches = [(-1, 0.0)] * n
+    if n == 0 or m == 0:
+        return matches
+
+    # columns of every row: the band around the diagonal from (0, 0) to (n, m),
+    # wide enough that the bands of consecutive rows overlap
+    band = max(band, -(-m // (2 * n)))
+    low = [max(0, i * m // n - band) for i in range(n + 1)]
+    high = [min(m, -(-i * m // n) + band) for i in range(n + 1)]
+    unreached = float('-inf')
+    score = [[unreached] * (m + 1) for _ in range(n + 1)]
+    back = [[0] * (m + 1) for _ in range(n + 1)]
+    pair_score = {}
+    for j in range(high[0] + 1):
+        score[0][j] = 0.0
+        back[0][j] = SKIP_EMITTED
+
+    for i in range(1, n + 1):
+        row, previous, back_row = score[i], score[i - 1], back[i]
+        first = max(low[i], 1)
+        row_scores = scorer.scores(reference[i - 1], emitted[first - 1:high[i]], threshold)
+        for j in range(low[i], high[i] + 1):
+            best, move = previous[j], SKIP_REFERENCE
+            if j > 0:
+                if row[j - 1] > best:
+                    best, move = row[j - 1], SKIP_EMITTED
+                if previous[j - 1] > unreached:
+                    s = row_scores[j - first]
+                    if s >= threshold and previous[j - 1] + s > best:
+                        best, move = previous[j - 1] + s, MATCH
+                        pair_score[i, j] = s
+            row[j] = best
+            back_row[j] = move
+
+    i, j = n, m
+    while i > 0:
+        move = back[i][j]
+        if move == MATCH:
+            matches[i - 1] = (j - 1, pair_score[i, j])
+            i, j = i - 1, j - 1
+        elif move == SKIP_EMITTED:
+            j -= 1
+        else:
+            i -= 1
+    return matches
+
+
+def align_responses(log_file, text_file, band=10, threshold=0.5, scorer=None, repair_log_file=None):
+    """
+    One row per token of text_file: Reference Word, Matched Word, Similarity.
+    Tokens no chunk matched take the word of a repair response for their
+    position (from log_file and repair_log_file) if it is similar enough.
+    """
+    scorer = scorer if scorer is not None else SimilarityScorer()
+    reference_words = load_index(text_file).words()
+    chunks = read_responses(log_file)
+    offsets = chunk_offsets(chunks, reference_words)
+
+    matched_words = np.full(len(reference_words), MISSING_WORD, dtype=object)
+    similarities = np.zeros(len(reference_words))
+    for chunk_num, (input_text, response) in sorted(chunks.items()):
+        start = offsets[chunk_num]
+        reference = reference_words[start:start + len(input_text.split())]
+        emitted = extract_words(response)
+        for i, (j, s) in enumerate(align_chunk(reference, emitted, band, threshold, scorer)):
+            if j >= 0:
+                matched_words[start + i] = emitted[j]
+                similarities[start + i] = s
+
+    repairs = read_repairs(log_file)
+    if repair_log_file is not None and os.path.exists(repair_log_file):
+        repairs.update(read_repairs(repair_log_file))
+    for position, word in repairs.items():
+        if 0 <= position < len(reference_words) and matched_words[position] == MISSING_WORD:
+            s = scorer.score(reference_words[position], word, threshold)
+            if s >= threshold:
+                matched_words[position] = word
+                similarities[position] = s
+
+    return pd.DataFrame({
+        'Reference Word': reference_words,
+        'Matched Word': matched_words,
+        'Similarity': similarities,
+    })
+
+
+def save_alignment(alignment, output_file):
+    alignment.to_excel(output_file, index=False)
+
+
+if __name__ == "__main__":
+    text_file = "data/Albuc1.txt" #tagger input
+    log_files = ["Prompt B - Albuc/rest/Albuc1_responses_phi4_prompt2.txt"] #responses logs of the tagger
+    output_dir = "Alignment - Albuc"
+
+    scorer = SimilarityScorer()  # shared by all logs
+    for log_file in log_files:
+        start_time = time.time()
+        # repairs of the run, if it had a repair pass
+        repair_log_file = log_file.replace("_responses_", "_repair_responses_")
+        alignment = align_responses(log_file, text_file, scorer=scorer, repair_log_file=repair_log_file)
+        stem = os.path.splitext(os.path.basename(log_file))[0]
+        output_file = os.path.join(output_dir, f"alignment_banded_{stem}.xlsx")
+        save_alignment(alignment, output_file)
+
+        missing = (alignment['Matched Word'] == MISSING_WORD).sum()
+        print(f"{stem}: {len(alignment) - missing} of {len(alignment)} words matched, "
+              f"mean similarity {alignment['Similarity'].mean():.3f}, "
+              f"{time.time() - start_time:.2f} seconds")
+        print(f"Results saved to {output_file}")
+    stats = scorer.stats()
+    print(f"Similarity: {stats['exact']} pairs scored, {stats['hits']} served from the cache, "
+          f"{stats['pruned']} rejected by the bounds")
@@ -1,50 +1,22 @@
 # -*- coding: utf-8 -*-
 
 import pandas as pd
-import glob
 import numpy as np
+from confusion_tensor import load_confusion_matrices
 
-# Get all Excel files containing confusion matrices
-file_paths = glob.glob("./confusion_matrix/*.xlsx")  # Update with your actual path
+# Load all Excel files containing confusion matrices onto one shared label axis
+tensor = load_confusion_matrices("./confusion_matrix/*.xlsx")  # Update with your actual path
 
-# Initialize counters for total correct predictions and total samples
-total_correct = 0
-total_samples = 0
+# Sum the counts of all files
+matrix = tensor.select()
+total_correct = np.trace(matrix)
+total_samples = matrix.sum()
 
-# Dictionary to store per-class TP and total instances
-class_stats = {}
-
-# Process each confusion matrix file
-for file in file_paths:
-    df = pd.read_excel(file, index_col=0)  # Read Excel file
-
-    # Ensure it's a square matrix (same number of rows & cols)
-    if df.shape[0] != df.shape[1]:
-        print(f"Skipping {file}: Not a valid confusion matrix.")
-        continue
-
-    # Convert to numpy array for fast calculations
-    matrix = df.values  
-
-    # Update overall accuracy calculations
-    total_correct += np.trace(matrix)  # Sum of diagonal elements
-    total_samples += np.sum(matrix)    # Sum of all elements in the matrix
-
-    # Process per-class accuracy
-    for i, label in enumerate(df.index):  # Assuming labels are row names
-        TP = matrix[i, i]  # True Positives for class i
-        total_class_samples = np.sum(matrix[i, :])  # Total instances of this class
-
-        if label not in class_stats:
-            class_stats[label] = {"TP": 0, "total": 0}
-
-        class_stats[label]["TP"] += TP
-        class_stats[label]["total"] += total_class_samples
-
-# Compute final per-class accuracy
+# Compute final per-class accuracy (true positives / instances of the class)
 class_accuracies = []
-for label, stats in class_stats.items():
-    class_accuracy = round(stats["TP"] / stats["total"], 4) if stats["total"] > 0 else 0
+for i, label in enumerate(tensor.labels):
+    total_class_samples = matrix[i, :].sum()
+    class_accuracy = round(matrix[i, i] / total_class_samples, 4) if total_class_samples > 0 else 0
     class_accuracies.append([label, class_accuracy])
 
 # Compute overall accuracy
@@ -58,4 +30,4 @@ accuracy_df.loc[len(accuracy_df)] = ["Overall Accuracy", overall_accuracy]
 accuracy_df.to_excel("aggregated_accuracy_report.xlsx", index=False)
 
 print("Aggregated per-class and overall accuracy saved.")
-print(accuracy_df)
\ No newline at end of file
+print(accuracy_df)
@@ -1,54 +1,27 @@
 # -*- coding: utf-8 -*-
-import pandas as pd
-import glob
-from sklearn.metrics import precision_recall_fscore_support
-
-# Load true labels
-true_labels_file = '.../data/REF_Albuc_1.xlsx' #reference file
-true_labels_df = pd.read_excel(true_labels_file)
-
-# Assuming the true labels are in a column named 'POS'
-true_labels = true_labels_df['POS']
+import os
+import sys
 
-# Load prediction files
-pred_files = glob.glob("./pred/*.xlsx")
-
-# Create a set of unique classes
-unique_classes = true_labels.unique()
+import pandas as pd
 
-# Prepare a dictionary to store cumulative metrics for each class
-precision_per_class = {cls: [] for cls in unique_classes}
-recall_per_class = {cls: [] for cls in unique_classes}
-f1_per_class = {cls: [] for cls in unique_classes}
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from confusion_tensor import classification_metrics, load_predictions
 
-# Iterate through each prediction file
-for pred_file in pred_files:
-    # Load prediction data
-    pred_df = pd.read_excel(pred_file)
-    
-    # Assuming the predictions are in a column named 'POS'
-    pred_labels = pred_df['upos']
-    
-    # Calculate precision, recall, and f1 for each class
-    precision, recall, f1, _ = precision_recall_fscore_support(true_labels, pred_labels, labels=unique_classes, average=None, zero_division=0)
-    
-    # Store the values for each class
-    for i, cls in enumerate(unique_classes):
-        precision_per_class[cls].append(precision[i])
-        recall_per_class[cls].append(recall[i])
-        f1_per_class[cls].append(f1[i])
+# Confusion counts of every prediction file against the reference
+true_labels_file = '.../data/REF_Albuc_1.xlsx' #reference file
+tensor, unique_classes = load_predictions(true_labels_file, "./pred/*.xlsx", gold_column='POS', pred_column='upos')
 
-# Now calculate the average precision, recall, and F1 for each class across all files
-avg_precision = {cls: round(sum(precision_per_class[cls])/len(precision_per_class[cls]), 2) for cls in unique_classes}
-avg_recall = {cls: round(sum(recall_per_class[cls])/len(recall_per_class[cls]),2) for cls in unique_classes}
-avg_f1 = {cls: round(sum(f1_per_class[cls])/len(f1_per_class[cls]),2) for cls in unique_classes}
+# Precision, recall and F1 for each reference class over all files, from the summed counts
+# (predictions outside the reference classes, e.g. 'missing', count as errors)
+class_positions = [tensor.labels.index(cls) for cls in unique_classes]
+metrics = classification_metrics(tensor.select(), class_positions)
 
 # Combine into a DataFrame for better readability
 summary_df = pd.DataFrame({
-    'precision': avg_precision,
-    'recall': avg_recall,
-    'f1': avg_f1
-})
+    'precision': metrics['precision'][class_positions].round(2),
+    'recall': metrics['recall'][class_positions].round(2),
+    'f1': metrics['f1'][class_positions].round(2)
+}, index=unique_classes)
 
 
 print(summary_df)
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Confusion counts of all runs in one tensor: corpus x model x prompt x true x pred.
+
+Every confusion matrix is reindexed onto a shared label axis, so files with
+different label sets or row orders add up correctly. Reports for the whole
+tensor or any slice (a corpus, a model, a prompt) are computed from the
+summed counts, never from rounded per-file scores.
+"""
+import glob
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+# <corpus>_tagged_<model>_<prompt> or tagged-<corpus>; model and prompt are optional
+RUN_NAME_RE = re.compile(r"^(?:(?P<corpus>.+?)_tagged|tagged-(?P<corpus_after>.+?))"
+                         r"(?:_(?P<model>.+?))?(?:_(?P<prompt>zero_shot|prompt1|prompt2))?$")
+FILE_SUFFIXES = ("_confusion_matrix_counts", "_detailed_metrics")
+
+
+def parse_run_name(file_name):
+    """
+    (corpus, model, prompt) of a result file name; model and prompt are '-'
+    when not given. Corpus and model are lower-cased, so Colaf/colaf and
+    Gemma2_9b/gemma2_9b are one corpus and one model.
+    """
+    stem = os.path.splitext(os.path.basename(file_name))[0]
+    for suffix in FILE_SUFFIXES:
+        if stem.endswith(suffix):
+            stem = stem[:-len(suffix)]
+    match = RUN_NAME_RE.match(stem)
+    if not match:
+        return None
+    corpus = (match.group('corpus') or match.group('corpus_after')).lower()
+    model = (match.group('model') or '-').lower()
+    return corpus, model, match.group('prompt') or '-'
+
+
+def confusion_counts(y_true, y_pred, labels):
+    """Confusion matrix over labels (rows true, columns predicted) with one bincount; other tags are dropped."""
+    index = pd.Index(labels)
+    true_codes = index.get_indexer(pd.Series(y_true).astype(str))
+    pred_codes = index.get_indexer(pd.Series(y_pred).astype(str))
+    keep = (true_codes >= 0) & (pred_codes >= 0)
+    n = len(labels)
+    counts = np.bincount(true_codes[keep] * n + pred_codes[keep], minlength=n * n)
+    return pd.DataFrame(counts.reshape(n, n), index=labels, columns=labels)
+
+
+def classification_metrics(counts, labels=None):
+    """
+    Precision, recall, F1 and support per class plus micro, macro and weighted
+    averages and accuracy from confusion counts of shape (..., L, L), with
+    sklearn's formulas and zero_division=0. labels (positions on the label
+    axis) selects the reported classes; by default every class that occurs
+    as true or predicted tag in the counts. Returns a dict of arrays with the
+    leading dimensions of counts.
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    tp = np.diagonal(counts, axis1=-2, axis2=-1)
+    pred_sum = counts.sum(axis=-2)
+    true_sum = counts.sum(axis=-1)
+    if labels is None:
+        occurring = (pred_sum + true_sum) > 0
+    else:
+        occurring = np.zeros(counts.shape[-1], dtype=bool)
+        occurring[list(labels)] = True
+        occurring = np.broadcast_to(occurring, tp.shape)
+
+    def divide(numerator, denominator):
+        numerator = np.asarray(numerator, dtype=float)
+        return np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator > 0)
+
+    precision = divide(tp, pred_sum)
+    recall = divide(tp, true_sum)
+    f1 = divide(2 * tp, true_sum + pred_sum)
+
+    selected_tp = np.where(occurring, tp, 0).sum(axis=-1)
+    selected_pred = np.where(occurring, pred_sum, 0).sum(axis=-1)
+    selected_true = np.where(occurring, true_sum, 0).sum(axis=-1)
+    n_selected = occurring.sum(axis=-1)
+
+    def macro(values):
+        return divide(np.where(occurring, values, 0).sum(axis=-1), n_selected)
+
+    def weighted(values):
+        return divide((np.where(occurring, values, 0) * true_sum).sum(axis=-1), selected_true)
+
+    total = counts.sum(axis=(-2, -1))
+    return {
+        'precision': precision, 'recall': recall, 'f1': f1, 'support': true_sum, 'selected': occurring,
+        'micro_precision': divide(selected_tp, selected_pred),
+        'micro_recall': divide(selected_tp, selected_true),
+        'micro_f1': divide(2 * selected_tp, selected_true + selected_pred),
+        'macro_precision': macro(precision), 'macro_recall': macro(recall), 'macro_f1': macro(f1),
+        'weighted_precision': weighted(precision), 'weighted_recall': weighted(recall), 'weighted_f1': weighted(f1),
+        'accuracy': divide(np.trace(counts, axis1=-2, axis2=-1), total),
+        'selected_support': selected_true, 'total': total,
+    }
+
+
+class ConfusionTensor:
+    AXES = ('corpus', 'model', 'prompt')
+
+    def __init__(self, corpora, models, prompts, labels, counts):
+        self.corpora = corpora
+        self.models = models
+        self.prompts = prompts
+        self.labels = labels
+        self.counts = counts  # int64, corpus x model x prompt x true x pred
+
+    @classmethod
+    def from_matrices(cls, matrices):
+        """matrices: {(corpus, model, prompt): confusion matrix DataFrame with labels as index and columns}"""
+        keys = list(matrices)
+        corpora = list(dict.fromkeys(k[0] for k in keys))
+        models = list(dict.fromkeys(k[1] for k in keys))
+        prompts = list(dict.fromkeys(k[2] for k in keys))
+        labels = list(dict.fromkeys(label for m in matrices.values() for label in list(m.index) + list(m.columns)))
+        counts = np.zeros((len(corpora), len(models), len(prompts), len(labels), len(labels)), dtype=np.int64)
+        for (corpus, model, prompt), matrix in matrices.items():
+            aligned = matrix.reindex(index=labels, columns=labels, fill_value=0).to_numpy(dtype=np.int64)
+            counts[corpora.index(corpus), models.index(model), prompts.index(prompt)] += aligned
+        return cls(corpora, models, prompts, labels, counts)
+
+    def _axis_values(self, axis):
+        return {'corpus': self.corpora, 'model': self.models, 'prompt': self.prompts}[axis]
+
+    def select(self, corpus=None, model=None, prompt=None):
+        """Counts of the selected slice, summed to one label x label matrix."""
+        counts = self.counts
+        for axis, value in zip(self.AXES, (corpus, model, prompt)):
+            # the axis to select on is always the leading one, the previous ones are summed away
+            if value is not None:
+                counts = counts[[self._axis_values(axis).index(value)]]
+            counts = counts.sum(axis=0)
+        return counts
+
+    def group_counts(self, by):
+        """Counts summed per group, one (group x label x label) array for one axis or a tuple of axes."""
+        by = (by,) if isinstance(by, str) else tuple(by)
+        kept = [self.AXES.index(axis) for axis in by]
+        summed = self.counts.sum(axis=tuple(i for i in range(3) if i not in kept))
+        groups = pd.MultiIndex.from_product([self._axis_values(axis) for axis in by], names=by)
+        return groups, summed.reshape(-1, len(self.labels), len(self.labels))
+
+    def report(self, corpus=None, model=None, prompt=None, labels=None):
+        """Classification report (one row per class, then micro, macro, weighted avg and accuracy) of a slice."""
+        label_positions = None if labels is None else [self.labels.index(label) for label in labels]
+        m = classification_metrics(self.select(corpus, model, prompt), label_positions)
+        rows = [[label, m['precision'][i], m['recall'][i], m['f1'][i], m['support'][i]]
+                for i, label in enumerate(self.labels) if m['selected'][i]]
+        support = m['selected_support']
+        rows.extend([
+            ["micro avg", m['micro_precision'], m['micro_recall'], m['micro_f1'], support],
+            ["macro avg", m['macro_precision'], m['macro_recall'], m['macro_f1'], support],
+            ["weighted avg", m['weighted_precision'], m['weighted_recall'], m['weighted_f1'], support],
+            ["accuracy", m['accuracy'], m['accuracy'], m['accuracy'], m['total']],
+        ])
+        report = pd.DataFrame(rows, columns=["label", "precision", "recall", "f1-score", "support"])
+        report[["precision", "recall", "f1-score"]] = report[["precision", "recall", "f1-score"]].astype(float)
+        report["support"] = report["support"].astype(int)
+        return report
+
+    def summary_by(self, by, labels=None):
+        """Accuracy and averaged scores of every group along one axis (or a tuple of axes), in one pass."""
+        groups, counts = self.group_counts(by)
+        label_positions = None if labels is None else [self.labels.index(label) for label in labels]
+        m = classification_metrics(counts, label_positions)
+        summary = pd.DataFrame({
+            'accuracy': m['accuracy'],
+            'micro f1': m['micro_f1'],
+            'macro precision': m['macro_precision'], 'macro recall': m['macro_recall'], 'macro f1': m['macro_f1'],
+            'weighted precision': m['weighted_precision'], 'weighted recall': m['weighted_recall'],
+            'weighted f1': m['weighted_f1'],
+            'tokens': m['total'],
+        }, index=groups)
+        return summary[summary['tokens'] > 0]
+
+
+def load_confusion_matrices(pattern):
+    """ConfusionTensor of all *_confusion_matrix_counts.xlsx files matching pattern (as written by results.py)."""
+    matrices = {}
+    for file in sorted(glob.glob(pattern)):
+        key = parse_run_name(file)
+        df = pd.read_excel(file, index_col=0)
+        if key is None or df.shape[0] != df.shape[1]:
+            print(f"Skipping {file}: Not a valid confusion matrix.")
+            continue
+        df.index = df.index.astype(str)
+        df.columns = df.columns.astype(str)
+        if key in matrices:
+            df = df.add(matrices[key], fill_value=0)
+        matrices[key] = df
+    return ConfusionTensor.from_matrices(matrices)
+
+
+def load_predictions(gold_file, pattern, gold_column='POS', pred_column='upos'):
+    """
+    ConfusionTensor of all prediction files (word/upos) matching pattern against
+    one reference file. The label axis holds the reference tags first, then
+    every other predicted tag, so reports can be restricted to the reference
+    tags while predictions such as 'missing' still count as errors.
+    """
+    y_true = pd.read_excel(gold_file)[gold_column].astype(str)
+    reference_labels = y_true.unique().tolist()
+    predictions = {}
+    for file in sorted(glob.glob(pattern)):
+        key = parse_run_name(file)
+        if key is None:
+            print(f"Skipping {file}: unknown file name")
+            continue
+        predictions[key] = pd.read_excel(file, keep_default_na=False)[pred_column].astype(str)[:len(y_true)]
+    extra = [tag for tag in pd.unique(pd.concat(list(predictions.values()))) if tag not in set(reference_labels)] \
+        if predictions else []
+    labels = reference_labels + extra
+    matrices = {key: confusion_counts(y_true[:len(y_pred)], y_pred, labels) for key, y_pred in predictions.items()}
+    return ConfusionTensor.from_matrices(matrices), reference_labels
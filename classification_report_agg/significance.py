@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+Uncertainty of the tagging results: bootstrap confidence intervals for
+accuracy and macro-F1 of every system, and paired significance tests
+(McNemar, approximate randomization) for every pair of systems.
+
+All prediction files of one corpus are read once and encoded as integer tag
+codes aligned with the reference. Every token is scored here: 'missing' and
+tags outside the reference tag set count as errors, so all systems are
+compared on the same tokens (results.py leaves those tokens out instead).
+
+Resampling works on per-unit count matrices (units are sentences or single
+tokens): a bootstrap replicate or a permutation is a weight vector over the
+units, and the counts of all replicates and systems are obtained with one
+matrix product per batch.
+
+Macro-F1 of a bootstrap replicate averages over the reference labels that
+occur in that replicate, not over the fixed label set of the full sample.
+A rare tag (INTJ, X, ...) drawn zero times would otherwise need a
+zero-division convention: F1 = 0 pulls the replicates down, F1 = 1 pulls
+them up, by up to 1/17 each time. Leaving it out keeps the replicates
+close to the point estimate. But the replicates average over a varying
+number of labels, so their distribution is not centred on the point
+estimate (on Albuc1 it lies at about the 45th percentile), and the
+macro-F1 intervals are asymmetric. Read them as percentile intervals of
+this statistic, not as point estimate +/- a margin. Accuracy is not
+affected.
+"""
+import glob
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.stats import binom
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from corpus_index import load_index
+
+
+def load_predictions(gold_file, pred_files, gold_column='POS', pred_column='upos'):
+    """
+    Encode the reference and all predictions with the reference tag set.
+    Returns (labels, gold codes, prediction codes of shape systems x tokens,
+    system names); predicted tags outside labels get the code -1.
+    """
+    gold_tags = pd.read_excel(gold_file)[gold_column].astype(str)
+    labels = gold_tags.unique().tolist()
+    index = pd.Index(labels)
+    gold = index.get_indexer(gold_tags).astype(np.int16)
+
+    names = []
+    preds = np.full((len(pred_files), len(gold)), -1, dtype=np.int16)
+    for s, pred_file in enumerate(pred_files):
+        pred_tags = pd.read_excel(pred_file, keep_default_na=False)[pred_column].astype(str)
+        if len(pred_tags) != len(gold):
+            print(f"Warning: {pred_file} has {len(pred_tags)} tokens, the reference {len(gold)}")
+        n = min(len(pred_tags), len(gold))
+        preds[s, :n] = index.get_indexer(pred_tags[:n])
+        names.append(os.path.splitext(os.path.basename(pred_file))[0])
+    return labels, gold, preds, names
+
+
+def sentence_lengths(text_file, n_tokens):
+    """Tokens per sentence of a text with one sentence per line (as the tagger input)."""
+    lengths = load_index(text_file).sentence_lengths
+    lengths = lengths[lengths > 0]
+    if lengths.sum() != n_tokens:
+        raise ValueError(f"{text_file} has {lengths.sum()} tokens, the reference {n_tokens}")
+    return lengths
+
+
+def unit_counts(gold, preds, n_labels, lengths=None):
+    """
+    Per-unit counts: true (units x labels) and, per system, true positives and
+    predictions (systems x units x labels). lengths gives the tokens of each
+    unit in order; None makes every token its own unit.
+    """
+    n_tokens = len(gold)
+    if lengths is None:
+        unit = np.arange(n_tokens)
+        n_units = n_tokens
+    else:
+        unit = np.repeat(np.arange(len(lengths)), lengths)
+        n_units = len(lengths)
+    size = n_units * n_labels
+
+    true = np.bincount(unit * n_labels + gold, minlength=size).reshape(n_units, n_labels).astype(np.float32)
+    tp = np.zeros((len(preds), n_units, n_labels), dtype=np.float32)
+    pred = np.zeros((len(preds), n_units, n_labels), dtype=np.float32)
+    for s, system in enumerate(preds):
+        known = system >= 0
+        tp[s] = np.bincount(unit * n_labels + gold, weights=system == gold, minlength=size).reshape(n_units, n_labels)
+        pred[s] = np.bincount(unit[known] * n_labels + system[known], minlength=size).reshape(n_units, n_labels)
+    return true, tp, pred
+
+
+def scores(true, tp, pred):
+    """
+    Accuracy and macro-F1 from summed counts; works on any leading dimensions.
+    Macro-F1 averages over the reference labels present in the counts, so a
+    rare tag missing from a bootstrap replicate does not count as F1 = 0
+    (see the module docstring).
+    """
+    accuracy = tp.sum(axis=-1) / true.sum(axis=-1)
+    denominator = true + pred
+    f1 = np.divide(2 * tp, denominator, out=np.zeros_like(denominator), where=denominator > 0)
+    present = true > 0
+    return accuracy, (f1 * present).sum(axis=-1) / present.sum(axis=-1)
+
+
+def _flatten_systems(counts):
+    # systems x units x labels -> units x (systems * labels), for one matrix product over all systems
+    n_systems, n_units, n_labels = counts.shape
+    return counts.transpose(1, 0, 2).reshape(n_units, n_systems * n_labels)
+
+
+def bootstrap_ci(true, tp, pred, n_boot=2000, alpha=0.05, seed=0, batch=250):
+    """
+    Percentile bootstrap over units. Returns a dict of arrays with one value
+    per system: accuracy and macro_f1 with their _low and _high bounds.
+    """
+    rng = np.random.default_rng(seed)
+    n_systems, n_units, n_labels = tp.shape
+    tp_flat, pred_flat = _flatten_systems(tp), _flatten_systems(pred)
+    accuracy = np.empty((n_boot, n_systems))
+    macro_f1 = np.empty((n_boot, n_systems))
+    for start in range(0, n_boot, batch):
+        b = min(batch, n_boot - start)
+        # how often every unit is drawn in each replicate
+        draws = rng.integers(0, n_units, size=(b, n_units)) + np.arange(b)[:, None] * n_units
+        weights = np.bincount(draws.ravel(), minlength=b * n_units).reshape(b, n_units).astype(np.float32)
+        boot_true = (weights @ true)[:, None, :]
+        boot_tp = (weights @ tp_flat).reshape(b, n_systems, n_labels)
+        boot_pred = (weights @ pred_flat).reshape(b, n_systems, n_labels)
+        accuracy[start:start + b], macro_f1[start:start + b] = scores(boot_true, boot_tp, boot_pred)
+
+    point_accuracy, point_f1 = scores(true.sum(axis=0), tp.sum(axis=1), pred.sum(axis=1))
+    low, high = 100 * alpha / 2, 100 * (1 - alpha / 2)
+    return {
+        'accuracy': point_accuracy,
+        'accuracy_low': np.percentile(accuracy, low, axis=0),
+        'accuracy_high': np.percentile(accuracy, high, axis=0),
+        'macro_f1': point_f1,
+        'macro_f1_low': np.percentile(macro_f1, low, axis=0),
+        'macro_f1_high': np.percentile(macro_f1, high, axis=0),
+    }
+
+
+def mcnemar_tests(gold, preds):
+    """
+    Exact McNemar test for every pair of systems. Returns matrices (systems x
+    systems): only_a[i, j] tokens right in i and wrong in j, and two-sided p-values.
+    """
+    correct = (preds == gold).astype(np.float32)
+    only_a = correct @ (1 - correct).T
+    discordant = only_a + only_a.T
+    p_values = np.minimum(1.0, 2 * binom.cdf(np.minimum(only_a, only_a.T), discordant, 0.5))
+    return only_a.astype(np.int64), p_values
+
+
+def permutation_tests(true, tp, pred, n_perm=2000, seed=0, batch=250):
+    """
+    Paired approximate randomization test for every pair of systems: the
+    outputs of the two systems are swapped on a random subset of units and
+    the accuracy and macro-F1 differences recomputed. Returns two matrices of
+    two-sided p-values (systems x systems), for accuracy and macro-F1.
+    """
+    rng = np.random.default_rng(seed)
+    n_systems, n_units, n_labels = tp.shape
+    total_true = true.sum(axis=0)
+    total_tp, total_pred = tp.sum(axis=1), pred.sum(axis=1)
+    observed_accuracy, observed_f1 = scores(total_true, total_tp, total_pred)
+    exceed_accuracy = np.zeros((n_systems, n_systems))
+    exceed_f1 = np.zeros((n_systems, n_systems))
+
+    for start in range(0, n_perm, batch):
+        r = min(batch, n_perm - start)
+        swap = rng.integers(0, 2, size=(r, n_units)).astype(np.float32)
+        for a in range(n_systems - 1):
+            others = slice(a + 1, n_systems)
+            n_others = n_systems - a - 1
+            # counts moved from a to each other system on the swapped units
+            moved_tp = (swap @ _flatten_systems(tp[others] - tp[a])).reshape(r, n_others, n_labels)
+            moved_pred = (swap @ _flatten_systems(pred[others] - pred[a])).reshape(r, n_others, n_labels)
+            accuracy_a, f1_a = scores(total_true, total_tp[a] + moved_tp, total_pred[a] + moved_pred)
+            accuracy_b, f1_b = scores(total_true, total_tp[others] - moved_tp, total_pred[others] - moved_pred)
+            exceed_accuracy[a, others] += (np.abs(accuracy_a - accuracy_b)
+                                           >= np.abs(observed_accuracy[a] - observed_accuracy[others]) - 1e-12).sum(axis=0)
+            exceed_f1[a, others] += (np.abs(f1_a - f1_b)
+                                     >= np.abs(observed_f1[a] - observed_f1[others]) - 1e-12).sum(axis=0)
+
+    p_accuracy = (exceed_accuracy + exceed_accuracy.T + 1) / (n_perm + 1)
+    p_f1 = (exceed_f1 + exceed_f1.T + 1) / (n_perm + 1)
+    np.fill_diagonal(p_accuracy, 1.0)
+    np.fill_diagonal(p_f1, 1.0)
+    return p_accuracy, p_f1
+
+
+def analyse(gold_file, pred_files, text_file, output_file, n_boot=2000, n_perm=2000):
+    start = time.time()
+    labels, gold, preds, names = load_predictions(gold_file, pred_files)
+    lengths = sentence_lengths(text_file, len(gold))
+    print(f"Loaded {len(names)} systems, {len(gold)} tokens, {len(lengths)} sentences, {len(labels)} tags "
+          f"in {time.time() - start:.1f} seconds")
+
+    start = time.time()
+    token_counts = unit_counts(gold, preds, len(labels))
+    sentence_counts = unit_counts(gold, preds, len(labels), lengths)
+    token_ci = bootstrap_ci(*token_counts, n_boot=n_boot)
+    sentence_ci = bootstrap_ci(*sentence_counts, n_boot=n_boot)
+    print(f"Bootstrap ({n_boot} replicates, token and sentence level): {time.time() - start:.1f} seconds")
+
+    start = time.time()
+    only_a, p_mcnemar = mcnemar_tests(gold, preds)
+    p_accuracy, p_f1 = permutation_tests(*sentence_counts, n_perm=n_perm)
+    print(f"Paired tests ({len(names) * (len(names) - 1) // 2} pairs, {n_perm} sentence-level permutations): "
+          f"{time.time() - start:.1f} seconds")
+
+    systems = pd.DataFrame({
+        'System': names,
+        'Accuracy': token_ci['accuracy'],
+        'Accuracy CI low (token)': token_ci['accuracy_low'],
+        'Accuracy CI high (token)': token_ci['accuracy_high'],
+        'Accuracy CI low (sentence)': sentence_ci['accuracy_low'],
+        'Accuracy CI high (sentence)': sentence_ci['accuracy_high'],
+        'Macro F1': token_ci['macro_f1'],
+        'Macro F1 CI low (token)': token_ci['macro_f1_low'],
+        'Macro F1 CI high (token)': token_ci['macro_f1_high'],
+        'Macro F1 CI low (sentence)': sentence_ci['macro_f1_low'],
+        'Macro F1 CI high (sentence)': sentence_ci['macro_f1_high'],
+    }).sort_values('Accuracy', ascending=False)
+
+    pairs = []
+    for a in range(len(names)):
+        for b in range(a + 1, len(names)):
+            pairs.append([names[a], names[b],
+                          token_ci['accuracy'][a] - token_ci['accuracy'][b],
+                          token_ci['macro_f1'][a] - token_ci['macro_f1'][b],
+                          only_a[a, b], only_a[b, a], p_mcnemar[a, b],
+                          p_accuracy[a, b], p_f1[a, b]])
+    pairs = pd.DataFrame(pairs, columns=['System A', 'System B', 'Accuracy difference', 'Macro F1 difference',
+                                         'Only A correct', 'Only B correct', 'McNemar p',
+                                         'Permutation p (accuracy)', 'Permutation p (macro F1)'])
+
+    with pd.ExcelWriter(output_file) as writer:
+        systems.to_excel(writer, sheet_name='Systems', index=False)
+        pairs.to_excel(writer, sheet_name='Pairs', index=False)
+    print(systems.round(4).to_string(index=False))
+    print(f"Results saved to '{output_file}'")
+
+
+if __name__ == "__main__":
+    gold_file = "REF_Albuc_1.xlsx" #reference file
+    pred_files = sorted(glob.glob("./agg_performance_classes_models_prompting/predictions/Albuc1_tagged_*.xlsx"))
+    text_file = "../data/Albuc1.txt" #tagger input, one sentence per line
+    analyse(gold_file, pred_files, text_file, "significance_Albuc1.xlsx")
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Tagging results on spelling variation. The reference forms are grouped into
+orthographic variant clusters (variants.py) and every system is scored
+separately on the tokens of forms with other spellings in the text and on
+the tokens of forms with a single spelling.
+
+Consistency is the share of the variant tokens that get the tag a system
+gives most often within their cluster; the same number for the reference
+shows how far the clusters hold one part of speech.
+
+Every token is scored as in significance.py: 'missing' and tags outside the
+reference tag set count as errors.
+"""
+import glob
+import os
+import sys
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from significance import load_predictions
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from variants import VariantIndex
+
+
+def consistency(cluster, tags, n_clusters, n_labels):
+    """Share of the tokens whose tag is the most frequent tag of their cluster; tags -1 count as a tag of their own."""
+    counts = np.bincount(cluster * (n_labels + 1) + tags + 1, minlength=n_clusters * (n_labels + 1))
+    return counts.reshape(n_clusters, n_labels + 1).max(axis=1).sum() / len(tags)
+
+
+def variant_report(gold_file, pred_files, output_file, gold_column='Lemma'):
+    forms = pd.read_excel(gold_file, keep_default_na=False)[gold_column].astype(str)
+    counts = Counter(forms)
+    variants = VariantIndex.build(counts, counts=counts)
+    cluster = np.array([variants.cluster_of(form) for form in forms])
+    sizes = np.array([len(forms_of_cluster) for forms_of_cluster in variants.clusters])
+    has_variants = sizes[cluster] > 1
+    print(f"{len(counts)} forms in {len(variants.clusters)} clusters, "
+          f"{has_variants.sum()} of {len(forms)} tokens have a form with other spellings")
+
+    labels, gold, preds, names = load_predictions(gold_file, pred_files)
+    correct = preds == gold
+    n_clusters = len(variants.clusters)
+    variant_cluster = cluster[has_variants]
+    rows = []
+    for s, name in enumerate(names):
+        rows.append({
+            'system': name,
+            'accuracy': correct[s].mean(),
+            'variant accuracy': correct[s, has_variants].mean(),
+            'single-spelling accuracy': correct[s, ~has_variants].mean(),
+            'consistency': consistency(variant_cluster, preds[s, has_variants], n_clusters, len(labels)),
+        })
+    systems = pd.DataFrame(rows)
+    reference_consistency = consistency(variant_cluster, gold[has_variants], n_clusters, len(labels))
+
+    # per cluster: tokens, reference tags and the share every system gets right
+    multi = np.flatnonzero(sizes > 1)
+    tokens = np.bincount(cluster, minlength=n_clusters)
+    gold_counts = np.bincount(cluster * len(labels) + gold,
+                              minlength=n_clusters * len(labels)).reshape(n_clusters, len(labels))
+    clusters = pd.DataFrame({
+        'forms': ['/'.join(variants.clusters[c]) for c in multi],
+        'spellings': sizes[multi],
+        'tokens': tokens[multi],
+        'reference tag': [labels[k] for k in gold_counts[multi].argmax(axis=1)],
+        'reference share': gold_counts[multi].max(axis=1) / tokens[multi],
+    })
+    for s, name in enumerate(names):
+        clusters[name] = np.bincount(cluster, weights=correct[s], minlength=n_clusters)[multi] / tokens[multi]
+    clusters = clusters.sort_values('tokens', ascending=False)
+
+    with pd.ExcelWriter(output_file) as writer:
+        systems.to_excel(writer, sheet_name='Systems', index=False)
+        clusters.to_excel(writer, sheet_name='Clusters', index=False)
+    print(systems.round(4).to_string(index=False))
+    print(f"Reference consistency: {reference_consistency:.4f}")
+    print(f"Results saved to '{output_file}'")
+
+
+if __name__ == "__main__":
+    gold_file = "REF_Albuc_1.xlsx" #reference file
+    pred_files = sorted(glob.glob("./agg_performance_classes_models_prompting/predictions/Albuc1_tagged_*.xlsx"))
+    variant_report(gold_file, pred_files, "variant_accuracy_Albuc1.xlsx")
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent index of a corpus text (one sentence per line, as Albuc1.txt and
+NAF6195.txt), built once and shared by the tagging and evaluation stages.
+
+The index is stored next to the text in .corpus_index/<text name>/ and holds
+memory-mappable arrays:
+
+    token_ids.npy     uint32  vocabulary id of every token (text.split() order)
+    byte_offsets.npy  uint64  start of every token in the UTF-8 file
+    byte_lengths.npy  uint32  length of every token in bytes
+    line_starts.npy   int64   first token of every line, plus the token count
+                              (lines as readlines() gives them, so an empty
+                              line is an empty sentence)
+    vocab.json                the interned word forms, position = token id
+    meta.json                 SHA-256 of the text and the array sizes
+
+It is rebuilt whenever the SHA-256 of the text changes. UD tags are stored
+as uint8 codes (see TAG_CODES), so stages can join on integer positions and
+codes instead of strings.
+"""
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+INDEX_VERSION = 1
+INDEX_DIR = ".corpus_index"
+
+# Universal Dependencies v2 tags; every other value ('missing', empty cells, ...) is MISSING_CODE
+UD_TAGS = ("ADJ", "ADP", "ADV", "AUX", "CCONJ", "DET", "INTJ", "NOUN", "NUM",
+           "PART", "PRON", "PROPN", "PUNCT", "SCONJ", "SYM", "VERB", "X")
+TAG_CODES = {tag: code for code, tag in enumerate(UD_TAGS)}
+MISSING_CODE = 255
+
+TOKEN_RE = re.compile(r"\S+")
+LINE_BREAK_RE = re.compile(r"\r\n|\r|\n")  # universal newlines, as in text mode
+
+
+def encode_tags(tags):
+    """uint8 codes of a sequence of tags."""
+    codes = pd.Index(UD_TAGS).get_indexer(pd.Series(tags, dtype=object))
+    return np.where(codes >= 0, codes, MISSING_CODE).astype(np.uint8)
+
+
+def decode_tags(codes):
+    """Tags of uint8 codes; MISSING_CODE gives 'missing'."""
+    table = np.array(UD_TAGS + ('missing',) * (256 - len(UD_TAGS)), dtype=object)
+    return table[np.asarray(codes, dtype=np.uint8)]
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class CorpusIndex:
+    def __init__(self, text_file, index_path, meta, token_ids, byte_offsets, byte_lengths, line_starts, vocab):
+        self.text_file = text_file
+        self.index_path = index_path
+        self.sha256 = meta['sha256']
+        self.token_ids = token_ids
+        self.byte_offsets = byte_offsets
+        self.byte_lengths = byte_lengths
+        self.line_starts = line_starts
+        self.vocab = vocab
+        self._vocab_array = None
+        self._form_ids = None
+
+    @property
+    def n_tokens(self):
+        return len(self.token_ids)
+
+    @property
+    def sentence_starts(self):
+        """First token of every line (readlines() order, empty lines included)."""
+        return self.line_starts[:-1]
+
+    @property
+    def sentence_lengths(self):
+        return np.diff(self.line_starts)
+
+    def sentence_ids(self):
+        """0-based line number of every token."""
+        return np.repeat(np.arange(len(self.sentence_lengths)), self.sentence_lengths)
+
+    def words(self, start=0, end=None):
+        """Word forms of the tokens start:end."""
+        if self._vocab_array is None:
+            self._vocab_array = np.array(self.vocab, dtype=object)
+        return self._vocab_array[self.token_ids[start:end]]
+
+    def form_id(self, form):
+        """Token id of a word form, -1 if it does not occur in the text."""
+        if self._form_ids is None:
+            self._form_ids = {w: i for i, w in enumerate(self.vocab)}
+        return self._form_ids.get(form, -1)
+
+
+def index_path_for(text_file):
+    text_file = os.path.abspath(text_file)
+    return os.path.join(os.path.dirname(text_file), INDEX_DIR, os.path.basename(text_file))
+
+
+def build_index(text_file, index_path=None):
+    """Tokenize text_file like str.split() and write the index arrays."""
+    index_path = index_path or index_path_for(text_file)
+    with open(text_file, 'rb') as f:
+        raw = f.read()
+    text = raw.decode('utf-8')
+
+    matches = list(TOKEN_RE.finditer(text))
+    tokens = [m.group() for m in matches]
+    if len(tokens) != len(text.split()):
+        raise ValueError(f"Tokenization of '{text_file}' does not match str.split()")
+    char_starts = np.array([m.start() for m in matches], dtype=np.int64)
+    char_ends = np.array([m.end() for m in matches], dtype=np.int64)
+
+    # character offsets -> byte offsets from the UTF-8 length of every character
+    code_points = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+    char_bytes = 1 + (code_points >= 0x80) + (code_points >= 0x800) + (code_points >= 0x10000)
+    byte_at = np.concatenate(([0], np.cumsum(char_bytes, dtype=np.int64)))
+    byte_offsets = byte_at[char_starts].astype(np.uint64)
+    byte_lengths = (byte_at[char_ends] - byte_at[char_starts]).astype(np.uint32)
+
+    # lines as readlines() returns them: a last line without line break still counts
+    line_char_starts = [0] + [m.end() for m in LINE_BREAK_RE.finditer(text)]
+    if line_char_starts[-1] == len(text):
+        line_char_starts.pop()
+    line_starts = np.searchsorted(char_starts, np.array(line_char_starts, dtype=np.int64))
+    line_starts = np.append(line_starts, len(tokens)).astype(np.int64)
+
+    token_ids, vocab = pd.factorize(pd.Series(tokens, dtype=object))
+    meta = {
+        'version': INDEX_VERSION,
+        'text_file': os.path.basename(text_file),
+        'sha256': hashlib.sha256(raw).hexdigest(),
+        'n_tokens': len(tokens),
+        'n_lines': len(line_starts) - 1,
+        'n_forms': len(vocab),
+    }
+
+    os.makedirs(index_path, exist_ok=True)
+    np.save(os.path.join(index_path, 'token_ids.npy'), token_ids.astype(np.uint32))
+    np.save(os.path.join(index_path, 'byte_offsets.npy'), byte_offsets)
+    np.save(os.path.join(index_path, 'byte_lengths.npy'), byte_lengths)
+    np.save(os.path.join(index_path, 'line_starts.npy'), line_starts)
+    with open(os.path.join(index_path, 'vocab.json'), 'w', encoding='utf-8') as f:
+        json.dump(list(vocab), f, ensure_ascii=False)
+    # meta.json last: an index without it is incomplete and gets rebuilt
+    with open(os.path.join(index_path, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+def load_index(text_file, index_path=None, rebuild=False):
+    """Index of text_file, built first if it is missing or the text has changed."""
+    index_path = index_path or index_path_for(text_file)
+    meta_file = os.path.join(index_path, 'meta.json')
+    sha256 = file_sha256(text_file)
+    meta = None
+    if not rebuild and os.path.exists(meta_file):
+        with open(meta_file, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('version') != INDEX_VERSION or meta.get('sha256') != sha256:
+            meta = None
+    if meta is None:
+        print(f"Building corpus index of '{text_file}' in '{index_path}'")
+        meta = build_index(text_file, index_path)
+
+    def array(name):
+        return np.load(os.path.join(index_path, f'{name}.npy'), mmap_mode='r')
+
+    with open(os.path.join(index_path, 'vocab.json'), 'r', encoding='utf-8') as f:
+        vocab = json.load(f)
+    return CorpusIndex(text_file, index_path, meta, array('token_ids'), array('byte_offsets'),
+                       array('byte_lengths'), np.asarray(array('line_starts')), vocab)
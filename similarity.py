@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Word similarity for the alignment stage: the ratio of difflib.SequenceMatcher
+(2 * matching characters / total length) on Unicode characters, after NFC
+normalization, so a composed and a decomposed "é" are the same character.
+
+A candidate can only reach the threshold if two cheap upper bounds of the
+ratio do: the length bound (at most min(len) characters can match) and the
+character multiset bound (at most the shared characters, counted with
+multiplicity, can match). Only the candidates that pass both are scored
+exactly. Exact scores, and the multiset bounds of rejected pairs, are
+memoized, so word pairs that repeat across the response logs are scored once
+per run.
+"""
+import unicodedata
+from collections import Counter
+from difflib import SequenceMatcher
+
+import numpy as np
+
+
+class SimilarityScorer:
+    def __init__(self):
+        self.cache = {}  # (a, b) -> exact ratio
+        self.bounds = {}  # (a, b) -> multiset upper bound, for pairs not scored exactly
+        self._forms = {}  # word -> (NFC form, length, character counts)
+        self.exact = 0  # pairs scored with SequenceMatcher
+        self.hits = 0  # pairs served from the cache
+        self.pruned = 0  # pairs rejected by an upper bound
+
+    def _form(self, word):
+        form = self._forms.get(word)
+        if form is None:
+            normalized = unicodedata.normalize('NFC', word)
+            form = self._forms[word] = (normalized, len(normalized), Counter(normalized))
+        return form
+
+    def score(self, a, b, threshold=0.0):
+        """Similarity of a and b, or 0.0 if it is certainly below threshold."""
+        key = (a, b)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.hits += 1
+            return cached if cached >= threshold else 0.0
+        a_form, a_length, a_counts = self._form(a)
+        b_form, b_length, b_counts = self._form(b)
+        total = a_length + b_length
+        if total == 0:
+            return 1.0
+        if threshold > 0:
+            if 2 * min(a_length, b_length) < threshold * total:
+                self.pruned += 1
+                return 0.0
+            bound = self.bounds.get(key)
+            if bound is None:
+                shared = sum(min(count, b_counts.get(c, 0)) for c, count in a_counts.items())
+                bound = self.bounds[key] = 2 * shared / total
+            if bound < threshold:
+                self.pruned += 1
+                return 0.0
+        ratio = SequenceMatcher(None, a_form, b_form, autojunk=False).ratio()
+        self.exact += 1
+        self.cache[key] = ratio
+        self.bounds.pop(key, None)
+        return ratio if ratio >= threshold else 0.0
+
+    def scores(self, word, candidates, threshold=0.0):
+        """
+        Similarity of word with every candidate as an array; candidates
+        certainly below threshold get 0.0. The length bound is checked before
+        any pair lookup.
+        """
+        result = np.zeros(len(candidates))
+        word_length = self._form(word)[1]
+        for k, candidate in enumerate(candidates):
+            length = self._form(candidate)[1]
+            if threshold > 0 and 2 * min(length, word_length) < threshold * (length + word_length):
+                self.pruned += 1
+                continue
+            result[k] = self.score(word, candidate, threshold)
+        return result
+
+    def stats(self):
+        return {'exact': self.exact, 'hits': self.hits, 'pruned': self.pruned, 'cached_pairs': len(self.cache)}
+
+
+def string_similarity(a, b):
+    """Similarity of two words without pruning or memoization."""
+    a, b = unicodedata.normalize('NFC', a), unicodedata.normalize('NFC', b)
+    return SequenceMatcher(None, a, b, autojunk=False).ratio()
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Index of orthographic variant clusters (homps/ome/om/omen/omne/hom/home,
+acayson/achaison/caison/cayson/queison/...) over a vocabulary of word forms.
+
+Every form gets a normalized key: case-folded, without diacritics and
+without punctuation around it, with the spelling rules of NORMALIZATION_RULES
+applied (h is dropped, y -> i, qu -> c, z -> s, double letters collapse, ...).
+Forms with the same key are variants. Keys are further joined when they are
+close in restricted Damerau-Levenshtein distance and start with the same letter:
+
+    - distance 1 for keys of at least min_length characters; candidates are
+      found through the one-deletion neighbourhood of every key
+      (acaison / aceison),
+    - distance up to skeleton_distance for keys of at least
+      skeleton_min_length characters with the same consonant skeleton
+      (vowel variation, e.g. aceison / acaison).
+
+The most frequent keys become cluster centres; every other key joins the
+closest centre it is linked to, so all spellings of a cluster are close to
+its centre and clusters do not chain into each other. Only keys that share a
+block (a deletion variant or a skeleton) with a centre are ever compared, so
+building stays close to linear in the vocabulary size. Once built, the
+cluster of a form and the tag evidence of that cluster are dict lookups.
+"""
+import json
+import re
+import string
+import unicodedata
+from collections import Counter, defaultdict
+
+NORMALIZATION_RULES = [
+    (re.compile(r"ph"), "f"),
+    (re.compile(r"th"), "t"),
+    (re.compile(r"qu"), "c"),
+    (re.compile(r"k"), "c"),
+    (re.compile(r"tz$"), "s"),
+    (re.compile(r"z"), "s"),
+    (re.compile(r"y"), "i"),
+    (re.compile(r"j"), "i"),
+    (re.compile(r"v"), "u"),
+    (re.compile(r"h"), ""),
+    (re.compile(r"(.)\1+"), r"\1"),
+]
+VOWELS_RE = re.compile(r"[aeiou]")
+PUNCTUATION = string.punctuation + '«»“”‘’·'
+
+
+def normalize_form(form):
+    """Normalized spelling key of a word form; punctuation-only tokens are kept as they are."""
+    key = unicodedata.normalize('NFKD', str(form).casefold())
+    key = ''.join(c for c in key if not unicodedata.combining(c))
+    key = key.strip(PUNCTUATION)
+    if not key:
+        return str(form)
+    for pattern, replacement in NORMALIZATION_RULES:
+        key = pattern.sub(replacement, key)
+    return key or str(form)
+
+
+def skeleton(key):
+    return VOWELS_RE.sub("", key)
+
+
+def bounded_distance(a, b, max_distance):
+    """Restricted Damerau-Levenshtein distance of a and b, or max_distance + 1 if it is larger."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous_previous, previous = previous, current
+    return previous[-1]
+
+
+class VariantIndex:
+    def __init__(self, form_clusters, clusters):
+        self.form_clusters = form_clusters  # form -> cluster id
+        self.clusters = clusters  # cluster id -> forms
+        self.evidence = {}  # cluster id -> Counter of tags, see set_evidence
+
+    @classmethod
+    def build(cls, forms, counts=None, min_length=5, skeleton_min_length=6, skeleton_distance=2):
+        """
+        Index of the forms. counts (form -> frequency, optional) decides which
+        spellings become cluster centres; without it every form counts once.
+        """
+        forms = sorted(set(forms))
+        form_keys = {form: normalize_form(form) for form in forms}
+        weights = Counter()
+        for form, key in form_keys.items():
+            weights[key] += counts.get(form, 0) if counts is not None else 1
+
+        # keys, most frequent first, join the closest existing centre or become one
+        deletion_centres = defaultdict(list)
+        skeleton_centres = defaultdict(list)
+        centre_of = {}
+        for key in sorted(weights, key=lambda k: (-weights[k], k)):
+            alphabetic = key.isalpha()
+            candidates = []
+            if alphabetic and len(key) >= min_length:
+                deletions = {key} | {key[:i] + key[i + 1:] for i in range(len(key))}
+                candidates += [(c, 1) for d in deletions for c in deletion_centres.get(d, ())]
+            if alphabetic and len(key) >= skeleton_min_length:
+                candidates += [(c, skeleton_distance) for c in skeleton_centres.get(skeleton(key), ())]
+            best = None
+            for centre, max_distance in candidates:
+                # spelling variation hardly ever changes the first letter (h, qu/c are normalized)
+                if centre[0] != key[0]:
+                    continue
+                distance = bounded_distance(key, centre, max_distance)
+                if distance <= max_distance and (best is None or (distance, -weights[centre]) < best[0]):
+                    best = ((distance, -weights[centre]), centre)
+            if best is not None:
+                centre_of[key] = best[1]
+                continue
+
+            centre_of[key] = key
+            if alphabetic and len(key) >= min_length:
+                for d in {key} | {key[:i] + key[i + 1:] for i in range(len(key))}:
+                    deletion_centres[d].append(key)
+            if alphabetic and len(key) >= skeleton_min_length:
+                skeleton_centres[skeleton(key)].append(key)
+
+        cluster_ids = {}
+        form_clusters = {}
+        clusters = []
+        for form in forms:
+            centre = centre_of[form_keys[form]]
+            if centre not in cluster_ids:
+                cluster_ids[centre] = len(clusters)
+                clusters.append([])
+            form_clusters[form] = cluster_ids[centre]
+            clusters[cluster_ids[centre]].append(form)
+        return cls(form_clusters, clusters)
+
+    def cluster_of(self, form):
+        """Cluster id of a form, None if the form is not in the index."""
+        return self.form_clusters.get(form)
+
+    def variants_of(self, form):
+        cluster = self.form_clusters.get(form)
+        return self.clusters[cluster] if cluster is not None else [form]
+
+    def set_evidence(self, distributions):
+        """Sum the tag counts of the forms ({form: Counter}, e.g. Lexicon.distributions()) per cluster."""
+        self.evidence = {}
+        for form, tag_counts in distributions.items():
+            cluster = self.form_clusters.get(form)
+            if cluster is None:
+                continue
+            if cluster in self.evidence:
+                self.evidence[cluster].update(tag_counts)
+            else:
+                self.evidence[cluster] = Counter(tag_counts)
+
+    def tag_evidence(self, form):
+        """Tag counts of all variants of a form (empty if none of them has evidence)."""
+        return self.evidence.get(self.form_clusters.get(form), Counter())
+
+    def save(self, index_file):
+        with open(index_file, 'w', encoding='utf-8') as f:
+            json.dump(self.clusters, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, index_file):
+        with open(index_file, 'r', encoding='utf-8') as f:
+            clusters = json.load(f)
+        form_clusters = {form: cluster for cluster, forms in enumerate(clusters) for form in forms}
+        return cls(form_clusters, clusters)